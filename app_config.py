@@ -0,0 +1,15 @@
+"""
+The one place config.toml is read.
+get_config() parses the file on first use and caches it, so every module
+shares one dict instead of each re-reading and re-parsing the file when it
+is imported.
+"""
+import functools
+import toml
+
+CONFIG_FILE = 'config.toml'
+
+@functools.lru_cache(maxsize=None)
+def get_config():
+    with open(CONFIG_FILE, 'r') as f:
+        return toml.load(f)
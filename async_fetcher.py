@@ -0,0 +1,125 @@
+"""
+Opt-in replacement for the fetcher threads (fetch_mode = "async").
+One event loop and one pooled keep-alive aiohttp session serve every request,
+and async_concurrency caps how many are in flight. Pages are pushed onto the
+same raw_data_queue the parser threads already consume.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from query import (fetch_sainsburys_products_async, peek_last_page, count_products, load_aiohttp, request_timeout,
+                   choose_page_size, smaller_page_size, PageTimeout, MIN_PAGE_SIZE, MAX_PAGE_SHRINKS)
+from thread_handler import raw_data_queue, PAGE_SIZE
+from display_live_info import calculate_counters
+from response_cache import record_page
+from category_stats import category_stats
+from progress_journal import journal
+from work_broker import LeasedWorkQueue
+from app_config import get_config
+
+aiohttp = load_aiohttp()  # this module is only imported in async mode
+logger = logging.getLogger(__name__)
+config = get_config()
+
+async def put_raw_page(page_ref, content):
+    # raw_data_queue is bounded: when it's full, wait in a worker thread rather than blocking the event loop
+    try:
+        raw_data_queue.put_nowait((page_ref, content), nbytes=len(content))
+    except queue.Full:
+        await asyncio.get_running_loop().run_in_executor(None, lambda: raw_data_queue.put((page_ref, content), nbytes=len(content)))
+
+async def fetch_page_async(client, search_term, page_number, page_size, search_by):
+    content = await fetch_sainsburys_products_async(client, search_term, page_number, page_size, search_by)
+    if content is None:
+        return None
+    record_page(search_by, search_term, page_number, page_size, content)
+    await put_raw_page((search_by, search_term, page_number), content)
+    return count_products(content)
+
+async def fetch_first_page_async(client, search_term, page_size, search_by, shrinks=MAX_PAGE_SHRINKS):
+    # same as thread_handler.fetch_first_page: halve the page size (up to shrinks times) when page 1 times out
+    # page_seconds is the successful request alone, not the rate limiter waits and retries around it
+    while True:
+        try:
+            content, page_seconds = await fetch_sainsburys_products_async(client, search_term, 1, page_size, search_by,
+                                                                          raise_on_timeout=shrinks > 0 and page_size > MIN_PAGE_SIZE, timed=True)
+            return content, page_size, page_seconds
+        except PageTimeout:
+            shrinks -= 1
+            page_size = smaller_page_size(page_size)
+            logger.info(f"Category {search_term}: page 1 timed out, retrying with page_size {page_size}.")
+
+async def fetch_data_async(client, search_term, page_size, search_by):
+    start_time = time.time()
+    page_seconds = None
+    known_pages, known_page_size, flushed_pages = journal.resume_state(search_by, search_term)
+    # flushed page numbers only mean something at the size they were fetched with, so a resumed term keeps it
+    page_size = known_page_size or choose_page_size(search_by, search_term, page_size)
+    if known_pages and 1 in flushed_pages:
+        last_page, products = known_pages, 0 # resuming: page 1 is already in the DB and told us the page count
+    else:
+        content, page_size, page_seconds = await fetch_first_page_async(client, search_term, page_size, search_by, 0 if known_page_size else MAX_PAGE_SHRINKS)
+        if content is None:
+            return
+        record_page(search_by, search_term, 1, page_size, content)
+        await put_raw_page((search_by, search_term, 1), content)
+        last_page = peek_last_page(content)
+        products = count_products(content)
+        journal.record_term(search_by, search_term, last_page, page_size)
+    remaining_pages = [page_number for page_number in range(2, last_page + 1) if page_number not in flushed_pages]
+    if remaining_pages:
+        counts = await asyncio.gather(*(fetch_page_async(client, search_term, page_number, page_size, search_by) for page_number in remaining_pages))
+        missing = counts.count(None)
+        products += sum(count for count in counts if count)
+        if missing:
+            logger.warning(f"Category {search_term}: {missing} of {last_page} pages could not be fetched.")
+    if last_page > 1:
+        logger.debug(f"Fetched all of category: {search_term} -  that had {last_page} pages.")
+    else:
+        logger.debug(f"Fetched all of category: {search_term}.")
+    if not flushed_pages:
+        category_stats.record(search_by, search_term, products, last_page, time.time() - start_time, page_size, page_seconds)
+    calculate_counters("categories")
+
+async def next_term(work_queue):
+    # a --worker's LeasedWorkQueue leases from the SQLite broker (and may wait for other workers' leases),
+    # which would stall every request in flight if it ran on the event loop
+    if isinstance(work_queue, LeasedWorkQueue):
+        return await asyncio.to_thread(work_queue.get_nowait)
+    return work_queue.get_nowait()
+
+async def async_fetcher_worker(client, category_queue, category_names_process_queue):
+    # both queues are filled before the loop starts, so an empty queue means that phase is done
+    while True:
+        try:
+            category_id = await next_term(category_queue)
+        except queue.Empty:
+            break
+        await fetch_data_async(client, category_id, PAGE_SIZE, "id")
+        category_queue.task_done()
+
+    if config.get('features', {}).get('process_category_names') == True:
+        while True:
+            try:
+                category_name = await next_term(category_names_process_queue)
+            except queue.Empty:
+                break
+            await fetch_data_async(client, category_name, PAGE_SIZE, "name")
+            category_names_process_queue.task_done()
+
+async def run_async_fetchers(category_queue, category_names_process_queue, concurrency):
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as client:
+        workers = [async_fetcher_worker(client, category_queue, category_names_process_queue) for _ in range(concurrency)]
+        await asyncio.gather(*workers)
+    logger.debug("Async fetcher: finished all tasks.")
+
+def start_async_fetcher(category_queue, category_names_process_queue, concurrency):
+    if aiohttp is None:
+        raise RuntimeError("fetch_mode = \"async\" requires aiohttp (pip install aiohttp)")
+    thread = threading.Thread(target=asyncio.run, args=(run_async_fetchers(category_queue, category_names_process_queue, concurrency),), daemon=True, name="Async-Fetcher")
+    thread.start()
+    return [thread]
@@ -0,0 +1,78 @@
+"""
+Throughput comparison of the product writers in db_handler.
+Writes synthetic products (ids prefixed "bench-") through each write path
+against the configured MySQL database (whatever [storage] backend is set), then deletes them again.
+
+Run from the repository root:
+    python -m benchmarks.db_writers --rows 50000 --batch-size 5000
+"""
+import argparse
+import random
+import time
+from parser import Product
+from db_handler import setup_mysql_database, get_connection, upsert_products, stage_and_merge_products
+
+def make_products(count, seed=0):
+    rng = random.Random(seed)
+    products = []
+    for i in range(count):
+        original_price = round(rng.uniform(0.3, 40), 2)
+        discounted_price = round(original_price * rng.uniform(0.5, 0.95), 2) if rng.random() < 0.2 else None
+        products.append(Product(
+            f"bench-{i}",
+            f"Benchmark product {i}",
+            original_price,
+            discounted_price,
+            ','.join(str(rng.randrange(10**12, 10**13)) for _ in range(rng.randint(1, 3))),
+            f"https://www.sainsburys.co.uk/gol-ui/product/bench-{i}",
+        ))
+    return products
+
+def delete_bench_rows():
+    with get_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM products WHERE id LIKE 'bench-%'")
+            connection.commit()
+
+def run_writer(name, write, products, batch_size):
+    delete_bench_rows()
+    # first pass inserts, second pass updates every row, like a daily re-scrape
+    results = []
+    for phase in ("insert", "update"):
+        if phase == "update":
+            products = [product._replace(original_price=round(product.original_price + 0.01, 2)) for product in products]
+        start = time.perf_counter()
+        written = 0
+        for i in range(0, len(products), batch_size):
+            saved, _ = write(products[i:i + batch_size])
+            written += saved
+        elapsed = time.perf_counter() - start
+        results.append((name, phase, written, elapsed))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare executemany upserts with staging-table bulk loads.")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_mysql_database()
+    writers = [
+        ("upsert (executemany)", upsert_products),
+        ("staging (LOAD DATA)", lambda batch: stage_and_merge_products(batch, "load_data")),
+        ("staging (multi-row insert)", lambda batch: stage_and_merge_products(batch, "insert")),
+    ]
+    results = []
+    try:
+        for name, write in writers:
+            results.extend(run_writer(name, write, make_products(args.rows), args.batch_size))
+    finally:
+        delete_bench_rows()
+
+    print(f"\n{'writer':<28} {'phase':<7} {'rows':>8} {'seconds':>9} {'rows/sec':>10}")
+    for name, phase, written, elapsed in results:
+        rate = written / elapsed if elapsed else 0
+        print(f"{name:<28} {phase:<7} {written:>8,} {elapsed:>9.2f} {rate:>10,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Local stand-in for the Sainsbury's product API, used by the pipeline benchmark.
+Serves generated pages in the same shape as the real endpoint (products plus
+controls.page.last) for category ids and keyword searches. Each term gets a
+deterministic catalogue with a mix of plain, CATCHWEIGHT and MULTIVARIANT
+products, promotions (including meal deals the parser skips) and products
+shared between categories. Latency and 503 errors can be injected, and
+bodies are gzipped when the client asks for it, like the real API.
+
+Run on its own (e.g. to point product_url at it):
+    python -m benchmarks.mock_api --port 8099 --latency 0.05
+"""
+import argparse
+import functools
+import gzip
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+SHARED_POOL_SIZE = 5000  # products that turn up in several categories, like the real site
+
+class MockCatalogue:
+    def __init__(self, min_products=50, max_products=5000, shared_fraction=0.1, seed=0):
+        self.min_products = min_products
+        self.max_products = max_products
+        self.shared_fraction = shared_fraction
+        self.seed = seed
+
+    def term_seed(self, term):
+        return zlib.crc32(f"{self.seed}:{term}".encode())
+
+    def product_count(self, term):
+        rng = random.Random(self.term_seed(term))
+        # skewed towards small categories with a long tail of big ones
+        return int(self.min_products + (self.max_products - self.min_products) * rng.random() ** 3)
+
+    def make_product(self, uid):
+        rng = random.Random(uid)
+        price = round(rng.uniform(0.3, 40), 2)
+        product = {
+            'product_uid': str(uid),
+            'name': f"Mock product {uid}",
+            'eans': [str(rng.randrange(10**12, 10**13)) for _ in range(rng.randint(1, 3))],
+            'full_url': f"https://www.sainsburys.co.uk/gol-ui/product/mock-{uid}",
+            'categories': [{'id': str(rng.randrange(100)), 'name': f"Mock category {rng.randrange(100)}"}],
+        }
+        kind = rng.random()
+        if kind < 0.05:
+            product['product_type'] = "CATCHWEIGHT"
+            product['catchweight'] = [{'range': f"{w}g", 'retail_price': {'price': round(price * w / 500, 2)}} for w in (400, 500, 600)]
+        elif kind < 0.10:
+            product['product_type'] = "MULTIVARIANT"
+            product['multivariants'] = [{'id': f"{uid}-{v}", 'retail_price': {'price': round(price + v * 0.5, 2)}} for v in range(rng.randint(2, 4))]
+        else:
+            product['product_type'] = "BASIC"
+            product['retail_price'] = {'price': price, 'measure': 'each'}
+            promo = rng.random()
+            if promo < 0.2:
+                product['retail_price']['price'] = round(price * rng.uniform(0.5, 0.95), 2)
+                product['promotions'] = [{'promo_type': 'SIMPLE_FIXED_PRICE', 'original_price': price}]
+            elif promo < 0.25:
+                product['promotions'] = [{'promo_type': 'MEAL_MULTI_DEAL_FOR_X', 'original_price': price + 1}]
+        return product
+
+    def product_uids(self, term):
+        rng = random.Random(self.term_seed(term) + 1)
+        base = 1_000_000 + (self.term_seed(term) % 100_000) * 10_000
+        uids = []
+        for i in range(self.product_count(term)):
+            if rng.random() < self.shared_fraction:
+                uids.append(rng.randrange(SHARED_POOL_SIZE))
+            else:
+                uids.append(base + i)
+        return uids
+
+    @functools.lru_cache(maxsize=64)  # retried pages are served from here
+    def page(self, term, page_number, page_size):
+        uids = self.product_uids(term)
+        last_page = max(1, -(-len(uids) // page_size))
+        start = (page_number - 1) * page_size
+        body = {
+            'products': [self.make_product(uid) for uid in uids[start:start + page_size]],
+            'controls': {'page': {'active': page_number, 'first': 1, 'last': last_page, 'size': page_size},
+                         'total_record_count': len(uids)},
+        }
+        return json.dumps(body).encode('utf-8')
+
+    def unique_products(self, terms):
+        return len({uid for term in terms for uid in self.product_uids(term)})
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlparse(self.path).query)
+        term = (query.get('filter[category]') or query.get('filter[keyword]') or [''])[0]
+        page_number = int(query.get('page_number', ['1'])[0])
+        page_size = int(query.get('page_size', ['60'])[0])
+        if server.latency:
+            time.sleep(server.latency * server.rng.uniform(0.5, 1.5))
+        with server.lock:
+            server.requests += 1
+            failed = server.rng.random() < server.error_rate
+            if failed:
+                server.errors += 1
+        if failed:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = server.catalogue.page(term, page_number, page_size)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if server.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_mock_api(catalogue, port=0, latency=0.0, error_rate=0.0, seed=0, compress=True):
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockAPIHandler)
+    server.daemon_threads = True
+    server.catalogue = catalogue
+    server.latency = latency
+    server.error_rate = error_rate
+    server.compress = compress
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.errors = 0
+    threading.Thread(target=server.serve_forever, daemon=True, name="Mock-API").start()
+    return server
+
+def api_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/groceries-api/gol-services/product/v1/product"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help="mean seconds added to each response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--no-compression', action='store_true', help="always send uncompressed bodies")
+    args = parser.parse_args()
+    server = start_mock_api(MockCatalogue(), args.port, args.latency, args.error_rate, compress=not args.no_compression)
+    print(f"Mock API on {api_url(server)} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
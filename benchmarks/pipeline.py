@@ -0,0 +1,144 @@
+"""
+End-to-end throughput of the scraping pipeline, without the network or MySQL.
+Starts the mock API from benchmarks.mock_api, points query.PRODUCT_URL at it
+and runs the real fetcher_worker -> parse_data -> start_db_consumer threads,
+with the product and price_history writers swapped for an in-memory store.
+Reports per-stage and end-to-end rates from the metrics module. With
+--price-alerts the price drop detector runs too, against a baseline where
+every tenth product used to cost more, posting to a local webhook receiver.
+
+Run from the repository root:
+    python -m benchmarks.pipeline --categories 200 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import logging
+import threading
+import time
+from queue import Queue
+import query
+import thread_handler
+import price_alerts
+from thread_handler import (start_fetcher_threads, start_parser_threads, start_db_consumer, stop_parser_pool, close_stage,
+                            raw_data_queue, parsed_product_queue, category_names_process_queue)
+from parser import parse_product_data
+from change_index import pack_prices
+from metrics import metrics_summary
+from pipeline_queue import queue_report, MeteredQueue
+from benchmarks.mock_api import MockCatalogue, start_mock_api, api_url
+from benchmarks.webhook_receiver import start_webhook_receiver, webhook_url
+
+class MemoryStore:
+    # stands in for the products and price_history tables
+    def __init__(self, write_latency=0.0):
+        self.write_latency = write_latency
+        self.products = {}
+        self.history_rows = 0
+        self.batches = 0
+
+    def save_products(self, product_infos, history_rows=()):
+        start_time = time.time()
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        for product in product_infos:
+            self.products[product.id] = product
+        self.history_rows += len(history_rows)
+        self.batches += 1
+        return len(product_infos), time.time() - start_time
+
+def seed_price_baseline(catalogue, terms):
+    # every tenth product was 25% dearer last time, so each of those is a drop
+    uids = sorted({uid for term in terms for uid in catalogue.product_uids(term)})
+    products, _ = parse_product_data([catalogue.make_product(uid) for uid in uids[::10]])
+    price_alerts.baseline = {product.id: pack_prices(product.original_price * 1.25, None) for product in products}
+    return len(price_alerts.baseline)
+
+def run_pipeline(terms, num_fetchers, num_parsers, price_alert_sinks=None):
+    category_queue = Queue()
+    for term in terms:
+        category_queue.put(term)
+    start = time.perf_counter()
+    fetcher_threads = start_fetcher_threads(category_queue, category_names_process_queue, num_fetchers)
+    parser_threads = start_parser_threads(num_parsers)
+    db_consumer_thread = threading.Thread(target=start_db_consumer, daemon=True, name="DB-Consumer")
+    db_consumer_thread.start()
+    if thread_handler.price_check_queue is not None:
+        price_alert_thread = threading.Thread(target=price_alerts.detect_price_drops, args=(thread_handler.price_check_queue, price_alert_sinks),
+                                              daemon=True, name="Price-Alerts")
+        price_alert_thread.start()
+
+    close_stage(fetcher_threads, raw_data_queue, len(parser_threads))
+    fetched = time.perf_counter()
+    close_stage(parser_threads, parsed_product_queue)
+    stop_parser_pool()
+    parsed = time.perf_counter()
+    db_consumer_thread.join()
+    if thread_handler.price_check_queue is not None:
+        price_alert_thread.join()
+    done = time.perf_counter()
+    return {'fetch': fetched - start, 'parse': parsed - start, 'total': done - start}
+
+def stage_line(name, amount, unit, seconds):
+    rate = amount / seconds if seconds else 0
+    return f"{name:<10} {amount:>12,} {unit:<9} {seconds:>8.2f}s {rate:>12,.0f} {unit}/sec"
+
+def main():
+    parser = argparse.ArgumentParser(description="Hermetic end-to-end pipeline benchmark against a mock API.")
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--min-products", type=int, default=50)
+    parser.add_argument("--max-products", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=thread_handler.PAGE_SIZE)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds the mock API adds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests the mock API fails with 503")
+    parser.add_argument("--no-compression", action='store_true', help="have the mock API send uncompressed bodies")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="seconds the DB stand-in takes per batch")
+    parser.add_argument("--fetchers", type=int, default=thread_handler.config.get('processing', {}).get('num_fetcher_threads', 24))
+    parser.add_argument("--parsers", type=int, default=thread_handler.config.get('processing', {}).get('num_parser_threads', 2))
+    parser.add_argument("--price-alerts", action='store_true', help="also run the price drop detector, posting to a local webhook receiver")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)  # injected errors would otherwise log a warning each
+
+    catalogue = MockCatalogue(args.min_products, args.max_products, seed=args.seed)
+    server = start_mock_api(catalogue, latency=args.latency, error_rate=args.error_rate, seed=args.seed, compress=not args.no_compression)
+    store = MemoryStore(args.db_latency)
+    # same modules the scraper runs, only the edges are swapped out
+    query.PRODUCT_URL = api_url(server)
+    query.max_retries = args.retries
+    query.retry_delay = 0.05
+    thread_handler.PAGE_SIZE = args.page_size
+    thread_handler.save_products_to_db = store.save_products
+
+    terms = list(range(1, args.categories + 1))
+    expected = catalogue.unique_products(terms)
+    sinks = None
+    if args.price_alerts:
+        receiver = start_webhook_receiver()
+        sinks = [price_alerts.WebhookSink(webhook_url(receiver))]
+        thread_handler.price_check_queue = MeteredQueue("price checks", maxsize=thread_handler.queue_config.get('parsed_max_pages', 50))
+        expected_drops = seed_price_baseline(catalogue, terms)
+    timings = run_pipeline(terms, args.fetchers, args.parsers, sinks)
+    server.shutdown()
+
+    summary = metrics_summary(timings['total'])
+    fetch_seconds = summary['scraper_fetch_seconds'].get('id', {})
+    parse_seconds = summary['scraper_parse_page_seconds'].get('all', {})
+    commit_seconds = summary['scraper_db_commit_seconds'].get('all', {})
+    pages = summary['scraper_fetch_responses_total'].get('200', 0)
+    print(f"\nMock API: {server.requests:,} requests, {server.errors:,} injected errors, {summary['scraper_fetch_retries_total']:,} retries")
+    print(stage_line("fetch", pages, "pages", timings['fetch']))
+    print(f"{'':<10} {summary['scraper_fetch_bytes_total'] / 1048576:>12,.1f} MB        {summary['scraper_fetch_wire_bytes_total'] / 1048576:,.1f} MB on the wire, latency mean {fetch_seconds.get('mean')}s p95 <= {fetch_seconds.get('p95')}s")
+    print(stage_line("parse", summary['scraper_parsed_products_total'], "products", timings['parse']))
+    print(f"{'':<10} {summary['scraper_parse_cpu_seconds_total']:>12.2f} CPU s     page mean {parse_seconds.get('mean')}s")
+    print(stage_line("db", len(store.products), "rows", timings['total']))
+    print(f"{'':<10} {store.batches:>12,} batches   commit mean {commit_seconds.get('mean')}s, {store.history_rows:,} price_history rows")
+    print(stage_line("end-to-end", len(store.products), "products", timings['total']))
+    if args.price_alerts:
+        print(f"{'alerts':<10} {len(receiver.events):>12,} drops     {receiver.posts:,} webhook posts (expected {expected_drops:,} drops)")
+        receiver.shutdown()
+    if len(store.products) != expected:
+        print(f"WARNING: stored {len(store.products):,} unique products, the mock catalogue has {expected:,}")
+    print('\n'.join(queue_report()))
+
+if __name__ == "__main__":
+    main()
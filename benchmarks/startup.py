@@ -0,0 +1,57 @@
+"""
+Startup cost of the scraper's modules.
+Imports each module in a fresh interpreter several times and reports the
+fastest wall time next to a bare interpreter, then lists the slowest imports
+behind one module from python -X importtime. Nothing here touches the
+network or the database, so it also checks that importing has no such side
+effects.
+
+Run from the repository root:
+    python -m benchmarks.startup --repeat 5 --detail main
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+MODULES = ['app_config', 'data_analysis', 'db_handler', 'query', 'thread_handler', 'main']
+
+def time_import(statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def slowest_imports(module, limit):
+    # -X importtime writes "import time: self [us] | cumulative | imported package" to stderr
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[0].split(':')[-1].strip().isdigit():
+            continue
+        rows.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description="Time how long each module takes to import in a fresh interpreter.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--detail", default="main", help="module to break down with -X importtime")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    baseline = time_import("pass", args.repeat)
+    print(f"\n{'module':<16} {'ms':>8} {'over bare python':>18}")
+    print(f"{'(bare python)':<16} {baseline * 1000:>8.1f}")
+    for module in MODULES:
+        elapsed = time_import(f"import {module}", args.repeat)
+        print(f"{module:<16} {elapsed * 1000:>8.1f} {(elapsed - baseline) * 1000:>18.1f}")
+
+    print(f"\nSlowest imports behind {args.detail} (cumulative ms):")
+    for cumulative, name in slowest_imports(args.detail, args.top):
+        print(f"{cumulative / 1000:>8.1f}  {name}")
+
+if __name__ == "__main__":
+    main()
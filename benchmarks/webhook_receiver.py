@@ -0,0 +1,72 @@
+"""
+Local stand-in for the price alert webhook.
+Accepts the {"events": [...]} POSTs the price alert stage sends, keeps them in
+memory and prints one line per drop, so [price_alerts] webhook_url can be
+tried out without a real endpoint. Failures can be injected with a 503 rate.
+
+Run on its own and point webhook_url at it:
+    python -m benchmarks.webhook_receiver --port 8098
+"""
+import argparse
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server.lock:
+            server.posts += 1
+            failed = server.rng.random() < server.error_rate
+        if failed:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        events = json.loads(body).get('events', [])
+        with server.lock:
+            server.events.extend(events)
+        if server.verbose:
+            for event in events:
+                print(f"{event['detected_at']}  {event['drop_percent']:>5.1f}% off  £{event['previous_price']:.2f} -> £{event['price']:.2f}  {event['name']}")
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_webhook_receiver(port=0, error_rate=0.0, verbose=False, seed=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), WebhookHandler)
+    server.daemon_threads = True
+    server.error_rate = error_rate
+    server.verbose = verbose
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.posts = 0
+    server.events = []
+    threading.Thread(target=server.serve_forever, daemon=True, name="Webhook-Receiver").start()
+    return server
+
+def webhook_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8098)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of posts answered with 503")
+    args = parser.parse_args()
+    server = start_webhook_receiver(args.port, args.error_rate, verbose=True)
+    print(f"Webhook receiver on {webhook_url(server)} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"\n{len(server.events):,} price drops in {server.posts:,} posts")
+
+if __name__ == "__main__":
+    main()
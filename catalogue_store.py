@@ -0,0 +1,105 @@
+"""
+Persistent catalogue of category ids and names.
+Each id/name is kept with the source it first came from and when it was first
+and last seen, and which sources list it (each with its own last_seen), along with the ETag/Last-Modified of every taxonomy URL, so the daily sync
+only downloads taxonomies that changed and only appends what's new to
+categoryids.txt / categorynames.txt instead of rewriting them. The text files
+stay the crawl's input; on first use the store is seeded from them.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from app_config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+class CatalogueStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()  # main syncs ids, the category saver thread adds names
+
+    def open(self):
+        with self.lock:
+            if self.connection is not None:
+                return
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS categories (kind TEXT, value TEXT, source TEXT, first_seen TEXT, last_seen TEXT,
+                                                       PRIMARY KEY (kind, value));
+                CREATE TABLE IF NOT EXISTS listings (kind TEXT, value TEXT, source TEXT, last_seen TEXT,
+                                                     PRIMARY KEY (kind, value, source));
+                CREATE TABLE IF NOT EXISTS http_validators (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, fetched_at TEXT);
+            ''')
+            self.connection.commit()
+        self.seed_from_file("id", config.get('files', {}).get('category_ids_file'))
+        self.seed_from_file("name", config.get('files', {}).get('category_names_file'))
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def seed_from_file(self, kind, file_path):
+        if not file_path or self.count(kind):
+            return
+        try:
+            with open(file_path, 'r') as f:
+                values = [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            return
+        self.record(kind, values, "file")
+        logger.info(f"Catalogue: seeded {len(values):,} {kind}s from {file_path}.")
+
+    def count(self, kind):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM categories WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def values(self, kind):
+        with self.lock:
+            return {row[0] for row in self.connection.execute("SELECT value FROM categories WHERE kind = ?", (kind,))}
+
+    def record(self, kind, values, source):
+        # marks every value as seen now and returns the ones that weren't in the catalogue yet
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        values = set(values)
+        with self.lock, self.connection:
+            known = {row[0] for row in self.connection.execute("SELECT value FROM categories WHERE kind = ?", (kind,))}
+            new_values = values - known
+            self.connection.executemany("INSERT INTO categories VALUES (?, ?, ?, ?, ?)", [(kind, value, source, now, now) for value in new_values])
+            self.connection.executemany("UPDATE categories SET last_seen = ? WHERE kind = ? AND value = ?", [(now, kind, value) for value in values & known])
+            self.connection.executemany("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)", [(kind, value, source, now) for value in values])
+        return new_values
+
+    def missing_since(self, kind, source, since):
+        # values a source used to list but didn't in its latest full download; by listing, so an id
+        # that two taxonomies share is reported against the one that stopped listing it
+        with self.lock:
+            return {row[0] for row in self.connection.execute("SELECT value FROM listings WHERE kind = ? AND source = ? AND last_seen < ?",
+                                                              (kind, source, since))}
+
+    def validators(self, url):
+        with self.lock:
+            row = self.connection.execute("SELECT etag, last_modified FROM http_validators WHERE url = ?", (url,)).fetchone()
+        return row if row else (None, None)
+
+    def save_validators(self, url, etag, last_modified):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO http_validators VALUES (?, ?, ?, ?)",
+                                    (url, etag, last_modified, time.strftime('%Y-%m-%d %H:%M:%S')))
+
+def append_lines(file_path, values, kind=None):
+    # new entries go on the end, the file is only written in full if it has gone missing
+    if kind is not None and not os.path.exists(file_path):
+        values = catalogue.values(kind)
+    if not values:
+        return
+    with open(file_path, 'a') as f:
+        f.writelines(f"{value}\n" for value in sorted(values))
+
+catalogue = CatalogueStore(config.get('files', {}).get('catalogue_file', 'catalogue.sqlite3'))
@@ -0,0 +1,113 @@
+"""
+Per-category stats kept across runs, and the scheduler that uses them.
+After each category/name is fetched we record its product count, pages,
+fetch time and when it last returned anything. The next run starts the most
+expensive ones first so they don't become the run's tail, and skips ids/names
+that have come back empty several runs in a row except for a periodic recheck.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date
+from work_broker import local_path
+from app_config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+schedule_config = config.get('scheduling', {})
+
+class CategoryStats:
+    def __init__(self, path):
+        self.path = path
+        self.stats = {}
+        self.merged_files = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(search_by, search_term):
+        return f"{search_by}:{search_term}"
+
+    @staticmethod
+    def read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def load(self):
+        # --worker runs save to their own file (see work_broker.local_path); those are merged in here,
+        # keeping whichever entry was checked most recently
+        self.stats = self.read(self.path)
+        root, ext = os.path.splitext(self.path)
+        self.merged_files = sorted(glob.glob(f"{root}.*{ext}"))
+        for worker_file in self.merged_files:
+            for key, entry in self.read(worker_file).items():
+                if key not in self.stats or entry.get('last_checked', '') >= self.stats[key].get('last_checked', ''):
+                    self.stats[key] = entry
+
+    def save(self):
+        path = local_path(self.path)
+        with self.lock:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.stats, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+            if path == self.path:
+                # the worker files' entries are in the shared file now
+                for worker_file in self.merged_files:
+                    os.remove(worker_file)
+                self.merged_files = []
+
+    def get(self, search_by, search_term):
+        return self.stats.get(self.key(search_by, search_term))
+
+    def record(self, search_by, search_term, products, pages, seconds, page_size=None, page_seconds=None):
+        # page_size/page_seconds: how long page 1 took at that size, which query.choose_page_size sizes the next run from
+        today = date.today().isoformat()
+        with self.lock:
+            entry = self.stats.setdefault(self.key(search_by, search_term), {'empty_runs': 0})
+            entry.update(products=products, pages=pages, seconds=round(seconds, 2), last_checked=today)
+            if page_seconds is not None:
+                entry.update(page_size=page_size, page_seconds=round(page_seconds, 3))
+            if products:
+                entry['last_nonempty'] = today
+                entry['empty_runs'] = 0
+            else:
+                entry['empty_runs'] = entry.get('empty_runs', 0) + 1
+
+    def is_dead(self, entry, today):
+        # empty for dead_after_empty_runs runs in a row, and not yet due for a recheck
+        if entry is None or entry.get('empty_runs', 0) < schedule_config.get('dead_after_empty_runs', 3):
+            return False
+        last_checked = date.fromisoformat(entry['last_checked'])
+        return (today - last_checked).days < schedule_config.get('dead_recheck_days', 7)
+
+    def expected_cost(self, entry):
+        # never-seen terms go first (they may be big), then slowest first, empties last
+        if entry is None:
+            return float('inf')
+        return entry.get('seconds', 0) if entry.get('products') else -1
+
+    def schedule(self, search_terms, search_by):
+        if schedule_config.get('order', 'longest_first') == "file":
+            return list(search_terms)
+        start_time = time.time()
+        today = date.today()
+        scheduled = []
+        skipped = 0
+        for search_term in search_terms:
+            entry = self.get(search_by, search_term)
+            if self.is_dead(entry, today):
+                skipped += 1
+                continue
+            scheduled.append((self.expected_cost(entry), search_term))
+        scheduled.sort(key=lambda item: item[0], reverse=True)  # stable, so ties keep file order
+        logger.info(f"Scheduled {len(scheduled):,} {search_by} searches longest-first, skipped {skipped:,} dead ones ({time.time() - start_time:.2f}s).")
+        return [search_term for _, search_term in scheduled]
+
+category_stats = CategoryStats(schedule_config.get('stats_file', 'category_stats.json'))
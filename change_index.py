@@ -0,0 +1,117 @@
+"""
+In-memory index of product id -> 64-bit fingerprint of (name, prices, eans, url)
+plus the last known prices. Loaded from the products table (or a sidecar file
+written by the previous run) at startup, it lets the DB consumer send only new
+or changed rows to MySQL and record price history only when a price moves.
+"""
+import hashlib
+import logging
+import math
+import os
+import pickle
+import threading
+import time
+from app_config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+change_config = config.get('change_detection', {})
+change_detection_enabled = change_config.get('enabled', False)
+price_history_enabled = config.get('price_history', {}).get('enabled', False)
+index_enabled = change_detection_enabled or price_history_enabled  # price history needs the last known prices
+
+def price_pence(price):
+    # DB rows come back as Decimal and parsed rows as float, so compare in whole pence
+    if price is None:
+        return -1
+    price = float(price)
+    return round(price * 100) if math.isfinite(price) else -1
+
+def fingerprint(name, original_price, discounted_price, eans, full_url):
+    key = f"{name}\x1f{price_pence(original_price)}\x1f{price_pence(discounted_price)}\x1f{eans}\x1f{full_url}"
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def product_fingerprint(product):
+    return fingerprint(product.name, product.original_price, product.discounted_price, product.eans, product.full_url)
+
+def pack_prices(original_price, discounted_price):
+    # both prices in one int: (original + 1) in the high 32 bits, (discounted + 1) in the low 32
+    return (price_pence(original_price) + 1) << 32 | (price_pence(discounted_price) + 1)
+
+def unpack_prices(packed):
+    original, discounted = (packed >> 32) - 1, (packed & 0xFFFFFFFF) - 1
+    return (None if original < 0 else original / 100, None if discounted < 0 else discounted / 100)
+
+def effective_price(original_price, discounted_price):
+    return discounted_price if discounted_price is not None else original_price
+
+class ChangeIndex:
+    def __init__(self):
+        self.fingerprints = {}
+        self.prices = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def load_rows(self, rows):
+        # rows are (id, name, original_price, discounted_price, eans, full_url) tuples
+        for product_id, name, original_price, discounted_price, eans, full_url in rows:
+            self.fingerprints[product_id] = fingerprint(name, original_price, discounted_price, eans, full_url)
+            self.prices[product_id] = pack_prices(original_price, discounted_price)
+
+    def changed(self, products):
+        # returns the products that are new or differ from what the DB holds
+        with self.lock:
+            return [product for product in products if self.fingerprints.get(product.id) != product_fingerprint(product)]
+
+    def price_changes(self, products, observed_at):
+        # price_history rows for products whose price differs from the last known one (or that are new)
+        rows = []
+        with self.lock:
+            for product in products:
+                previous = self.prices.get(product.id)
+                if previous == pack_prices(product.original_price, product.discounted_price):
+                    continue
+                previous_price = effective_price(*unpack_prices(previous)) if previous is not None else None
+                price = effective_price(product.original_price, product.discounted_price)
+                is_drop = previous_price is not None and price is not None and price < previous_price
+                rows.append((product.id, observed_at, product.original_price, product.discounted_price, previous_price, is_drop))
+        return rows
+
+    def commit(self, products):
+        # only call once the products are safely written
+        with self.lock:
+            for product in products:
+                self.fingerprints[product.id] = product_fingerprint(product)
+                self.prices[product.id] = pack_prices(product.original_price, product.discounted_price)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((self.fingerprints, self.prices), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            self.fingerprints, self.prices = pickle.load(f)
+
+change_index = ChangeIndex()
+
+def load_change_index(iter_product_rows):
+    if not index_enabled:
+        return
+    start_time = time.time()
+    sidecar_file = change_config.get('sidecar_file', 'product_index.pkl')
+    if change_config.get('source', 'db') == "sidecar" and os.path.exists(sidecar_file):
+        change_index.load(sidecar_file)
+        source = sidecar_file
+    else:
+        change_index.load_rows(iter_product_rows())
+        source = "products table"
+    logger.info(f"Change index: loaded {len(change_index):,} fingerprints from {source} in {time.time() - start_time:.1f}s.")
+
+def save_change_index():
+    if index_enabled and change_config.get('source', 'db') == "sidecar":
+        change_index.save(change_config.get('sidecar_file', 'product_index.pkl'))
@@ -0,0 +1,128 @@
+"""
+Columnar snapshot of the product catalogue, written with the array module.
+A snapshot is a directory with one file per column: prices as fixed-point
+int32 pence (-1 for no price), and each text column (id, name, eans, url)
+as one UTF-8 blob plus a uint64 offsets file with rows + 1 entries. meta.json
+records the row count, byte order and price scale, so the files can be read
+back with array.fromfile or memory-mapped by numpy without parsing.
+id_key.u64 holds dedupe.product_key(id) per row, so snapshots from different
+days can be joined on plain integers (see data_analysis --snapshots).
+"""
+import array
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+from dedupe import product_key
+
+PRICE_SCALE = 100  # prices are stored as integer pence
+TEXT_COLUMNS = ('id', 'name', 'eans', 'full_url')
+PRICE_COLUMNS = ('original_price', 'discounted_price')
+
+def to_fixed_point(price):
+    # no price, or the parser's inf for a CATCHWEIGHT/MULTIVARIANT product without one, is stored as -1
+    if price is None:
+        return -1
+    price = float(price)
+    return round(price * PRICE_SCALE) if math.isfinite(price) else -1
+
+def from_fixed_point(value):
+    return None if value < 0 else value / PRICE_SCALE
+
+def write_text_column(directory, column, values):
+    offsets = array.array('Q', [0])
+    with open(os.path.join(directory, f"{column}.bytes"), 'wb') as f:
+        position = 0
+        for value in values:
+            encoded = ('' if value is None else str(value)).encode('utf-8')
+            f.write(encoded)
+            position += len(encoded)
+            offsets.append(position)
+    with open(os.path.join(directory, f"{column}.offsets"), 'wb') as f:
+        offsets.tofile(f)
+
+def write_snapshot(directory, rows):
+    # rows are (id, name, original_price, discounted_price, eans, full_url); written to a temp
+    # directory and renamed so readers never see half a snapshot
+    rows = list(rows)
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    for column, index in (('id', 0), ('name', 1), ('eans', 4), ('full_url', 5)):
+        write_text_column(tmp_directory, column, (row[index] for row in rows))
+    for column, index in (('original_price', 2), ('discounted_price', 3)):
+        with open(os.path.join(tmp_directory, f"{column}.i32"), 'wb') as f:
+            array.array('i', (to_fixed_point(row[index]) for row in rows)).tofile(f)
+    with open(os.path.join(tmp_directory, 'id_key.u64'), 'wb') as f:
+        array.array('Q', (product_key(row[0]) for row in rows)).tofile(f)
+    with open(os.path.join(tmp_directory, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'rows': len(rows), 'byteorder': sys.byteorder, 'price_scale': PRICE_SCALE,
+                   'created': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+    return len(rows)
+
+def read_meta(directory):
+    with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def read_array(path, typecode, count, byteorder):
+    values = array.array(typecode)
+    with open(path, 'rb') as f:
+        values.fromfile(f, count)
+    if byteorder != sys.byteorder:
+        values.byteswap()
+    return values
+
+def read_text_column(directory, column, count, byteorder):
+    offsets = read_array(os.path.join(directory, f"{column}.offsets"), 'Q', count + 1, byteorder)
+    with open(os.path.join(directory, f"{column}.bytes"), 'rb') as f:
+        blob = f.read()
+    return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(count)]
+
+def read_snapshot(directory):
+    meta = read_meta(directory)
+    count, byteorder = meta['rows'], meta['byteorder']
+    columns = {column: read_text_column(directory, column, count, byteorder) for column in TEXT_COLUMNS}
+    for column in PRICE_COLUMNS:
+        columns[column] = read_array(os.path.join(directory, f"{column}.i32"), 'i', count, byteorder)
+    return columns
+
+def iter_snapshot_rows(directory):
+    columns = read_snapshot(directory)
+    for i in range(len(columns['id'])):
+        yield (columns['id'][i], columns['name'][i], from_fixed_point(columns['original_price'][i]),
+               from_fixed_point(columns['discounted_price'][i]), columns['eans'][i], columns['full_url'][i])
+
+def list_snapshots(root):
+    # snapshot directories are named by date, so sorting them sorts by age
+    try:
+        return sorted(os.path.join(root, name) for name in os.listdir(root)
+                      if not name.endswith('.tmp') and os.path.exists(os.path.join(root, name, 'meta.json')))
+    except FileNotFoundError:
+        return []
+
+class SnapshotCollector:
+    # gathers every product the DB consumer sees this run (changed or not) for the daily snapshot
+    def __init__(self):
+        self.rows = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, product_infos):
+        with self.lock:
+            for product in product_infos:
+                self.rows[product.id] = product
+
+    def write(self, root):
+        with self.lock:
+            if not self.rows:
+                return None
+            path = os.path.join(root, time.strftime('%Y-%m-%d'))
+            write_snapshot(path, self.rows.values())
+        return path
@@ -1,9 +1,14 @@
-import toml
+import argparse
+import os
 import mysql.connector
+from app_config import get_config
+from columnar_snapshot import read_meta, list_snapshots, PRICE_SCALE
+
+np = None  # numpy, imported by analyse_snapshots since only --snapshots needs it
 
 
 # Load config 
-config = toml.load("config.toml")
+config = get_config()
 db_config = config["database"]
 
 # Remove mysqltablename from connection parameters
@@ -38,7 +43,44 @@ def find_max_discounted_price_item(mycursor, table_name):
 
 def find_top_discount_percentage_items(mycursor, table_name):
     try:
-        mycursor.execute(f"SELECT *, (original_price - discounted_price) / original_price AS discount_percentage FROM {table_name} ORDER BY discount_percentage DESC LIMIT 5")
+        # discount_percentage is a stored generated column with its own index, so this reads 5 index entries instead of sorting the table
+        mycursor.execute(f"SELECT * FROM {table_name} WHERE discount_percentage IS NOT NULL ORDER BY discount_percentage DESC LIMIT 5")
+        return mycursor.fetchall()
+    except mysql.connector.Error as err:
+        print(f"Database error: {err}")
+        return []
+
+def find_top_deals(mycursor, limit=20):
+    # the deals table only holds currently discounted products, kept up to date by the scraper
+    try:
+        mycursor.execute("SELECT * FROM deals ORDER BY discount_percentage DESC LIMIT %s", (limit,))
+        return mycursor.fetchall()
+    except mysql.connector.Error as err:
+        print(f"Database error: {err}")
+        return []
+
+def count_deals(mycursor):
+    try:
+        mycursor.execute("SELECT COUNT(*) AS deals, MAX(discount_percentage) AS best FROM deals")
+        return mycursor.fetchone()
+    except mysql.connector.Error as err:
+        print(f"Database error: {err}")
+        return None
+
+def find_price_drops_today(mycursor, table_name):
+    # served by price_history's (is_drop, observed_at) index and today's partition only
+    try:
+        mycursor.execute(f"""SELECT h.product_id, p.name, h.previous_price, h.original_price, h.discounted_price, h.observed_at, p.full_url
+                              FROM price_history h JOIN {table_name} p ON p.id = h.product_id
+                              WHERE h.is_drop = 1 AND h.observed_at >= CURDATE() ORDER BY h.observed_at""")
+        return mycursor.fetchall()
+    except mysql.connector.Error as err:
+        print(f"Database error: {err}")
+        return []
+
+def get_price_series(mycursor, product_id):
+    try:
+        mycursor.execute("SELECT observed_at, original_price, discounted_price FROM price_history WHERE product_id = %s ORDER BY observed_at", (product_id,))
         return mycursor.fetchall()
     except mysql.connector.Error as err:
         print(f"Database error: {err}")
@@ -54,6 +96,11 @@ def print_top_discount_percentage_items(items):
         print(f"Name: {name}, Original Price: {original_price}, Discounted Price: {discounted_price}, Discount Percentage: {discount_percentage:.2%}, URL: {url}")
 
 
+def print_price_series(product_id, series):
+    print(f"Price history for {product_id}: {len(series)} changes")
+    for row in series:
+        print(f"  {row['observed_at']}  Original Price: {row['original_price']}, Discounted Price: {row['discounted_price']}")
+
 def get_table_size(mycursor, table_name):
     try:
         mycursor.execute(f"SELECT table_name AS `Table`, round(((data_length + index_length) / 1024 / 1024), 2) `Size in MB` FROM information_schema.TABLES WHERE table_name = '{table_name}'")
@@ -63,7 +110,106 @@ def get_table_size(mycursor, table_name):
         print(f"Database error: {err}")
         return None
 
-def main():
+def open_snapshot(directory):
+    # memory-maps the snapshot's columns, nothing is read until a column is used
+    meta = read_meta(directory)
+    count = meta['rows']
+    endian = '<' if meta['byteorder'] == 'little' else '>'
+    def column(file_name, dtype, length=count):
+        return np.memmap(os.path.join(directory, file_name), dtype=f"{endian}{dtype}", mode='r', shape=(length,)) if length else np.zeros(0, dtype)
+    snapshot = {'path': directory, 'rows': count}
+    snapshot['original_price'] = column('original_price.i32', 'i4')
+    snapshot['discounted_price'] = column('discounted_price.i32', 'i4')
+    snapshot['id_key'] = column('id_key.u64', 'u8')
+    for text in ('id', 'name', 'full_url'):
+        snapshot[f"{text}_offsets"] = column(f"{text}.offsets", 'u8', count + 1)
+        size = os.path.getsize(os.path.join(directory, f"{text}.bytes"))
+        snapshot[f"{text}_bytes"] = np.memmap(os.path.join(directory, f"{text}.bytes"), dtype='u1', mode='r') if size else b''
+    return snapshot
+
+def snapshot_text(snapshot, column, index):
+    offsets = snapshot[f"{column}_offsets"]
+    return bytes(snapshot[f"{column}_bytes"][offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+def effective_pence(snapshot):
+    # what the product costs now: the discounted price if there is one, -1 for no price
+    discounted = snapshot['discounted_price']
+    return np.where(discounted >= 0, discounted, snapshot['original_price'])
+
+def snapshot_discounts(snapshot):
+    original = snapshot['original_price'].astype(np.float64)
+    discounted = snapshot['discounted_price'].astype(np.float64)
+    discounted_mask = (discounted >= 0) & (original > 0) & (discounted < original)
+    return np.where(discounted_mask, (original - discounted) / np.where(original > 0, original, 1), 0.0)
+
+def top_snapshot_discounts(snapshot, limit=5):
+    discounts = snapshot_discounts(snapshot)
+    limit = min(limit, len(discounts))
+    if not limit:
+        return []
+    top = np.argpartition(-discounts, limit - 1)[:limit]
+    top = top[np.argsort(-discounts[top])]
+    return [{'name': snapshot_text(snapshot, 'name', i),
+             'original_price': snapshot['original_price'][i] / PRICE_SCALE,
+             'discounted_price': snapshot['discounted_price'][i] / PRICE_SCALE,
+             'discount_percentage': float(discounts[i]),
+             'full_url': snapshot_text(snapshot, 'full_url', i)} for i in top if discounts[i] > 0]
+
+def snapshot_price_drops(latest, previous):
+    # joins the two days on id_key with a sort + binary search, then compares effective prices
+    previous_keys = previous['id_key']
+    if not len(previous_keys) or not latest['rows']:
+        return np.zeros(0, np.int64), np.zeros(0), np.zeros(0)
+    order = np.argsort(previous_keys)
+    sorted_keys = previous_keys[order]
+    positions = np.clip(np.searchsorted(sorted_keys, latest['id_key']), 0, len(sorted_keys) - 1)
+    matched = sorted_keys[positions] == latest['id_key']
+    previous_price = effective_pence(previous)[order][positions]
+    latest_price = effective_pence(latest)
+    drops = np.flatnonzero(matched & (latest_price >= 0) & (previous_price > 0) & (latest_price < previous_price))
+    return drops, previous_price[drops] / PRICE_SCALE, latest_price[drops] / PRICE_SCALE
+
+def snapshot_price_stats(snapshot):
+    prices = effective_pence(snapshot)
+    prices = prices[prices >= 0] / PRICE_SCALE
+    if not len(prices):
+        return {'products': snapshot['rows']}
+    bands = [0, 1, 2, 5, 10, 20, 50, np.inf]
+    counts, _ = np.histogram(prices, bins=bands)
+    return {
+        'products': snapshot['rows'],
+        'priced': len(prices),
+        'discounted': int(np.count_nonzero(snapshot_discounts(snapshot))),
+        'mean': round(float(prices.mean()), 2),
+        'median': round(float(np.median(prices)), 2),
+        'p10': round(float(np.percentile(prices, 10)), 2),
+        'p90': round(float(np.percentile(prices, 90)), 2),
+        'bands': {f"£{low}-{high}": int(count) for low, high, count in zip(bands[:-1], bands[1:], counts)},
+    }
+
+def analyse_snapshots(snapshot_root):
+    global np
+    try:
+        import numpy as np
+    except ImportError:
+        print("Snapshot analysis needs numpy (pip install numpy).")
+        return
+    snapshots = list_snapshots(snapshot_root)
+    if not snapshots:
+        print(f"No snapshots found in {snapshot_root}.")
+        return
+    latest = open_snapshot(snapshots[-1])
+    print(f"Snapshot {os.path.basename(snapshots[-1])}: {snapshot_price_stats(latest)}")
+    print_top_discount_percentage_items(top_snapshot_discounts(latest))
+    if len(snapshots) > 1:
+        previous = open_snapshot(snapshots[-2])
+        drops, previous_prices, latest_prices = snapshot_price_drops(latest, previous)
+        print(f"Price drops since {os.path.basename(snapshots[-2])}: {len(drops)}")
+        biggest = np.argsort(latest_prices / previous_prices)[:10]
+        for i in biggest:
+            print(f"Name: {snapshot_text(latest, 'name', drops[i])}, Was: {previous_prices[i]:.2f}, Now: {latest_prices[i]:.2f}")
+
+def main(product_ids=()):
     mydb, mycursor = establish_connection(connection_params)
     if mydb is None or mycursor is None:
         return
@@ -73,6 +219,15 @@ def main():
     top_discount_percentage_items = find_top_discount_percentage_items(mycursor, table_name)
     print(f"Table size: {get_table_size(mycursor, table_name)} MB")
     print_top_discount_percentage_items(top_discount_percentage_items)
+    if config.get('deals', {}).get('enabled', True):
+        deals = count_deals(mycursor)
+        if deals and deals["deals"]:
+            print(f"Current deals: {deals['deals']}, best {deals['best']:.2%} off")
+            print_top_discount_percentage_items(find_top_deals(mycursor))
+    if config.get('price_history', {}).get('enabled'):
+        print(f"Price drops today: {len(find_price_drops_today(mycursor, table_name))}")
+    for product_id in product_ids:
+        print_price_series(product_id, get_price_series(mycursor, product_id))
 
     if mydb.is_connected():
         mycursor.close()
@@ -80,4 +235,13 @@ def main():
         print("Database connection closed.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Reports on the scraped products")
+    parser.add_argument('--snapshots', nargs='?', const=config.get('storage', {}).get('snapshot_dir', 'snapshots'), metavar='DIR',
+                        help="analyse the columnar snapshots (memory-mapped with numpy) instead of querying MySQL")
+    parser.add_argument('--history', nargs='+', default=[], metavar='PRODUCT_ID',
+                        help="also print the recorded price changes of these products (needs [price_history] enabled)")
+    args = parser.parse_args()
+    if args.snapshots:
+        analyse_snapshots(args.snapshots)
+    else:
+        main(args.history)
\ No newline at end of file
@@ -1,112 +1,342 @@
-import toml
 from mysql.connector import Error
 from mysql.connector.pooling import MySQLConnectionPool
 import logging
+import os
 import time
 import re
+import tempfile
+import threading
 from display_live_info import calculate_counters
+from change_index import price_history_enabled
+from storage_backends import StorageBackend, SQLiteBackend, ColumnarSnapshotBackend, split_deals
+from catalogue_store import catalogue, append_lines
+from app_config import get_config
 
 logger = logging.getLogger(__name__)
 
-# Load configuration from config.toml
-with open('config.toml', 'r') as f:
-    config = toml.load(f)
+config = get_config()
 
-db_config = config['database']  # gets db config from config.toml
-
-# Remove unsupported arguments from db_config
+# Copy without unsupported arguments, the config dict itself is shared with every other module
 unsupported_keys = ['mysqltablename']
-for key in unsupported_keys:
-    db_config.pop(key, None)
+db_config = {key: value for key, value in config['database'].items() if key not in unsupported_keys}
+
+DB_WRITE_MODE = config.get('processing', {}).get('db_write_mode', 'upsert')
+STAGING_LOAD = config.get('processing', {}).get('staging_load', 'load_data')
+STAGING_INSERT_ROWS = config.get('processing', {}).get('staging_insert_rows', 500)
+STORAGE_BACKEND = config.get('storage', {}).get('backend', 'mysql')
+DEALS_ENABLED = config.get('deals', {}).get('enabled', True)
+DEALS_MIN_DISCOUNT = config.get('deals', {}).get('min_discount', 0.0)
+DEALS_DELETE_ROWS = 1000  # ids per DELETE when products in a batch stop being deals
+# fraction off the original price, NULL when the product isn't discounted
+DISCOUNT_EXPRESSION = "IF(discounted_price IS NOT NULL AND original_price > 0, (original_price - discounted_price) / original_price, NULL)"
+NON_ASCII = re.compile(r'[^\x00-\x7F]')
+NAME_FLUSH_SIZE = 500  # new category names are recorded and appended to the names file in batches of this size
+if DB_WRITE_MODE == "staging" and STAGING_LOAD == "load_data":
+    db_config['allow_local_infile'] = True
 
-connection_pool = MySQLConnectionPool(pool_name="mypool", pool_size=5, **db_config)
+connection_pool = None  # created on first use, so importing this module doesn't need a live server
+pool_lock = threading.Lock()
+
+def get_pool():
+    global connection_pool
+    with pool_lock:
+        if connection_pool is None:
+            connection_pool = MySQLConnectionPool(pool_name="mypool", pool_size=5, **db_config)
+    return connection_pool
 
 def get_connection():
     try:
-        connection = connection_pool.get_connection()
+        connection = get_pool().get_connection()
         if connection.is_connected():
             return connection
     except Error as e:
         logger.warn(f"Error connecting to MySQL: {e}")
     return None
 
-def setup_database():
+def setup_mysql_database():
     try:
         with get_connection() as connection:
             if connection is None: raise Error("No connection available") # Explicit raise for cleaner handling
             with connection.cursor() as cursor:
-                cursor.execute('''
+                cursor.execute(f'''
                     CREATE TABLE IF NOT EXISTS products (
                         id VARCHAR(255) PRIMARY KEY,
                         name TEXT,
                         original_price DECIMAL(10, 2),
                         discounted_price DECIMAL(10, 2),
                         eans TEXT,
-                        full_url TEXT
+                        full_url TEXT,
+                        discount_percentage DECIMAL(6, 4) AS ({DISCOUNT_EXPRESSION}) STORED,
+                        KEY idx_discount_percentage (discount_percentage),
+                        KEY idx_original_price (original_price),
+                        KEY idx_discounted_price (discounted_price)
                     )
                 ''')
+                add_discount_column(cursor)
+                if DEALS_ENABLED:
+                    # products currently discounted by at least deals.min_discount, kept in step by the writers
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS deals (
+                            product_id VARCHAR(255) PRIMARY KEY,
+                            name TEXT,
+                            original_price DECIMAL(10, 2),
+                            discounted_price DECIMAL(10, 2),
+                            discount_percentage DECIMAL(6, 4) NOT NULL,
+                            full_url TEXT,
+                            first_seen DATETIME NOT NULL,
+                            updated_at DATETIME NOT NULL,
+                            KEY idx_deal_discount (discount_percentage)
+                        )
+                    ''')
+                    sync_deals_from_products(cursor)
+                if price_history_enabled:
+                    # append-only, one row per observed price change; range partitioned by month so
+                    # date-bounded queries ("all drops today") only touch one partition
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS price_history (
+                            product_id VARCHAR(255) NOT NULL,
+                            observed_at DATETIME NOT NULL,
+                            original_price DECIMAL(10, 2),
+                            discounted_price DECIMAL(10, 2),
+                            previous_price DECIMAL(10, 2),
+                            is_drop TINYINT(1) NOT NULL DEFAULT 0,
+                            PRIMARY KEY (product_id, observed_at),
+                            KEY idx_drops (is_drop, observed_at)
+                        )
+                        PARTITION BY RANGE COLUMNS(observed_at) (
+                            PARTITION p_future VALUES LESS THAN (MAXVALUE)
+                        )
+                    ''')
+                    add_history_partitions(cursor)
                 connection.commit() # Commit moved inside the outer with block
     except Error as e:
         logger.error(f"Error setting up database: {e}")
 
-def save_products_to_db(product_infos):
+def sync_deals_from_products(cursor):
+    # the writers only update deals from the rows they write, and with change detection on an unchanged
+    # discounted product is never written; so at startup deals is brought in line with products and the
+    # current min_discount (this also fills a new table and applies a changed threshold)
+    start_time = time.time()
+    cursor.execute("""DELETE d FROM deals d LEFT JOIN products p
+                      ON p.id = d.product_id AND p.discount_percentage > 0 AND p.discount_percentage >= %s
+                      WHERE p.id IS NULL""", (DEALS_MIN_DISCOUNT,))
+    removed = cursor.rowcount
+    cursor.execute("""INSERT INTO deals (product_id, name, original_price, discounted_price, discount_percentage, full_url, first_seen, updated_at)
+                      SELECT id, name, original_price, discounted_price, discount_percentage, full_url, NOW(), NOW() FROM products
+                      WHERE discount_percentage > 0 AND discount_percentage >= %s
+                      ON DUPLICATE KEY UPDATE name=VALUES(name), original_price=VALUES(original_price), discounted_price=VALUES(discounted_price),
+                      discount_percentage=VALUES(discount_percentage), full_url=VALUES(full_url)""", (DEALS_MIN_DISCOUNT,))
+    logger.info(f"Deals synced from products in {time.time() - start_time:.1f}s ({removed} no longer deals).")
+
+def add_discount_column(cursor):
+    # tables created before discount_percentage existed get the column and indexes added once
+    cursor.execute("""SELECT COUNT(*) FROM information_schema.COLUMNS
+                      WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'products' AND COLUMN_NAME = 'discount_percentage'""")
+    if cursor.fetchone()[0]:
+        return
+    logger.info("Adding discount_percentage column and price indexes to products, this can take a while on a big table.")
+    cursor.execute(f"""ALTER TABLE products ADD COLUMN discount_percentage DECIMAL(6, 4) AS ({DISCOUNT_EXPRESSION}) STORED,
+                       ADD KEY idx_discount_percentage (discount_percentage),
+                       ADD KEY idx_original_price (original_price),
+                       ADD KEY idx_discounted_price (discounted_price)""")
+
+history_partitions_month = None  # (year, month) the price_history partitions were last checked in
+
+def ensure_history_partitions():
+    # a run that goes on past the end of next month would otherwise write into p_future,
+    # so the partitions are checked again whenever the month changes. ALTER TABLE commits
+    # implicitly, so this runs on its own connection before a batch's transaction starts
+    global history_partitions_month
+    if history_partitions_month == time.localtime()[:2]:
+        return
+    try:
+        with get_connection() as connection:
+            if connection is None: raise Error("No connection available")
+            with connection.cursor() as cursor:
+                add_history_partitions(cursor)
+        history_partitions_month = time.localtime()[:2]
+    except Error as e:
+        logger.error(f"Error adding price_history partitions: {e}")
+
+def add_history_partitions(cursor, months_ahead=1):
+    # split p_future so the current and next month(s) each get their own partition
+    cursor.execute("""SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+                      WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'price_history'""")
+    existing = {row[0] for row in cursor.fetchall()}
+    latest = max((name for name in existing if name != 'p_future'), default=None)
+    year, month = time.localtime()[:2]
+    for _ in range(months_ahead + 1):
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        name = f"p{year}{month:02d}"
+        if name not in existing and (latest is None or name > latest):
+            cursor.execute(f"""ALTER TABLE price_history REORGANIZE PARTITION p_future INTO (
+                                PARTITION {name} VALUES LESS THAN ('{next_year}-{next_month:02d}-01'),
+                                PARTITION p_future VALUES LESS THAN (MAXVALUE))""")
+            logger.info(f"Added price_history partition {name}.")
+        year, month = next_year, next_month
+
+PRODUCT_COLUMNS = "id, name, original_price, discounted_price, eans, full_url"
+STAGING_TABLE = "products_staging"
+
+def save_products_to_db(product_infos, history_rows=()):
+    # history_rows (price_history rows for this batch) are committed together with the products
     if not product_infos:
         logger.error("No products to save.")
         return 0, 0
+    calculate_counters("products", len(product_infos))
+    return get_storage_backend().save_products(product_infos, history_rows)
+
+def save_mysql_products(product_infos, history_rows=()):
+    if history_rows:
+        ensure_history_partitions()
+    if DB_WRITE_MODE == "staging":
+        return stage_and_merge_products(product_infos, STAGING_LOAD, history_rows)
+    return upsert_products(product_infos, history_rows)
+
+def upsert_products(product_infos, history_rows=()):
     try:
         with get_connection() as connection:
             if connection is None: raise Error("No connection available")
             with connection.cursor() as cursor:
                 start_time = time.time()
-                for product in product_infos:
-                    calculate_counters("products")
-                 #   logger.debug(f"EANs before saving: {product['eans']}") 
                 placeholders = ', '.join(['%s'] * len(product_infos[0]))
-                query = f"""INSERT INTO products (id, name, original_price, discounted_price, eans, full_url)
+                query = f"""INSERT INTO products ({PRODUCT_COLUMNS})
                            VALUES ({placeholders}) ON DUPLICATE KEY UPDATE name=VALUES(name), original_price=VALUES(original_price),
                                    discounted_price=VALUES(discounted_price), eans=VALUES(eans), full_url=VALUES(full_url)"""
-                cursor.executemany(query, [tuple(product.values()) for product in product_infos])
+                cursor.executemany(query, product_infos)  # Product tuples, already in column order
+                if DEALS_ENABLED:
+                    sync_deals(cursor, product_infos)
+                insert_price_history(cursor, history_rows)
                 connection.commit()
                 return len(product_infos), time.time() - start_time
     except Error as e:
         logger.error(f"Error saving products: {e}")
         return 0, 0
-    
+
+def stage_and_merge_products(product_infos, load_method="load_data", history_rows=()):
+    # bulk-load the batch into a per-connection staging table, then merge it into products with one statement
+    try:
+        with get_connection() as connection:
+            if connection is None: raise Error("No connection available")
+            with connection.cursor() as cursor:
+                start_time = time.time()
+                rows = product_infos
+                # temporary tables are private to the connection and dropped when the pool resets it
+                # spelled out rather than LIKE products, so loads don't maintain the generated column and price indexes
+                cursor.execute(f"""CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} (id VARCHAR(255) PRIMARY KEY, name TEXT, original_price DECIMAL(10, 2),
+                                   discounted_price DECIMAL(10, 2), eans TEXT, full_url TEXT)""")
+                cursor.execute(f"TRUNCATE TABLE {STAGING_TABLE}")
+                if load_method == "load_data":
+                    load_staging_file(cursor, rows)
+                else:
+                    insert_staging_rows(cursor, rows)
+                cursor.execute(f"""INSERT INTO products ({PRODUCT_COLUMNS}) SELECT {PRODUCT_COLUMNS} FROM {STAGING_TABLE}
+                                   ON DUPLICATE KEY UPDATE name=VALUES(name), original_price=VALUES(original_price),
+                                   discounted_price=VALUES(discounted_price), eans=VALUES(eans), full_url=VALUES(full_url)""")
+                if DEALS_ENABLED:
+                    sync_deals(cursor, product_infos)
+                insert_price_history(cursor, history_rows)
+                connection.commit()
+                return len(rows), time.time() - start_time
+    except Error as e:
+        logger.error(f"Error saving products through staging table: {e}")
+        return 0, 0
+
+def sync_deals(cursor, product_infos):
+    # only the products in this batch can have started or stopped being deals, so the
+    # deals table is updated from the batch alone, in the same transaction as products
+    deal_rows, not_deals = split_deals(product_infos, DEALS_MIN_DISCOUNT, time.strftime('%Y-%m-%d %H:%M:%S'))
+    if deal_rows:
+        cursor.executemany("""INSERT INTO deals (product_id, name, original_price, discounted_price, discount_percentage, full_url, first_seen, updated_at)
+                              VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                              ON DUPLICATE KEY UPDATE name=VALUES(name), original_price=VALUES(original_price), discounted_price=VALUES(discounted_price),
+                              discount_percentage=VALUES(discount_percentage), full_url=VALUES(full_url), updated_at=VALUES(updated_at)""", deal_rows)
+    for i in range(0, len(not_deals), DEALS_DELETE_ROWS):
+        chunk = not_deals[i:i + DEALS_DELETE_ROWS]
+        cursor.execute(f"DELETE FROM deals WHERE product_id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+def escape_infile_field(value):
+    # LOAD DATA's default format: tab separated, backslash escaped, \N for NULL
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+def load_staging_file(cursor, rows):
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='\n', suffix='.tsv', delete=False) as f:
+        for row in rows:
+            f.write('\t'.join(escape_infile_field(value) for value in row) + '\n')
+        path = f.name
+    try:
+        # REPLACE so a product repeated within the batch keeps its last version
+        cursor.execute(f"LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE {STAGING_TABLE} CHARACTER SET utf8mb4 ({PRODUCT_COLUMNS})", (path,))
+    finally:
+        os.remove(path)
+
+def insert_staging_rows(cursor, rows):
+    # fallback when local_infile is disabled on the server: multi-row REPLACEs of STAGING_INSERT_ROWS rows
+    for i in range(0, len(rows), STAGING_INSERT_ROWS):
+        chunk = rows[i:i + STAGING_INSERT_ROWS]
+        placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(chunk))
+        cursor.execute(f"REPLACE INTO {STAGING_TABLE} ({PRODUCT_COLUMNS}) VALUES {placeholders}", [value for row in chunk for value in row])
+
+def sanitize_category_name(category_name):
+    # Allow only ASCII characters (0-127) and replace others with spaces; most names are already ASCII
+    if category_name.isascii():
+        return category_name
+    return NON_ASCII.sub(' ', category_name)
+
 def save_category_names(category_names_save_queue): 
-    all_category_names = set()
     logger.info("Category name saver thread started.")
-
-    # Load existing category names from file
     file_path = config.get('files', {}).get('category_names_file')
-    try:
-        with open(file_path, 'r') as f:
-            existing_names = set(line.strip() for line in f)
-            all_category_names.update(existing_names) 
-    except FileNotFoundError:
-        pass # If the file doesn't exist, it's okay, we'll create it
+    catalogue.open()
+    known_names = catalogue.values("name")
+    pending_names = set()
+    saved = 0
+
+    def flush():
+        nonlocal saved
+        new_names = catalogue.record("name", pending_names, "search")
+        append_lines(file_path, new_names, "name")
+        known_names.update(pending_names)
+        saved += len(new_names)
+        pending_names.clear()
 
     while True:
         category_name = category_names_save_queue.get()
         if category_name is None:  # Signal to stop
-            logger.info("Category name saver thread finished.")
             break
-
-        # Allow only ASCII characters (0-127) and replace others with spaces
-        sanitized_name = re.sub(r'[^\x00-\x7F]', ' ', category_name)
-        all_category_names.add(sanitized_name) # Add the sanitized name to the set
-
+        sanitized_name = sanitize_category_name(category_name)
+        if sanitized_name not in known_names:
+            pending_names.add(sanitized_name)
+            if len(pending_names) >= NAME_FLUSH_SIZE:
+                flush()
         category_names_save_queue.task_done()
 
-    # Sort the unique category names
-    sorted_category_names = sorted(list(all_category_names))
+    flush()
+    logger.info(f"Category name saver thread finished: {saved} new category names appended to {file_path}.")
 
-    # Save sorted and unique category names to file
-    with open(file_path, 'w') as f:
-        for category_name in sorted_category_names:
-            f.write(category_name + '\n') # Use category_name instead of sanitized_name
-    logger.info(f"Saved {len(sorted_category_names)} category names to file.")
+def insert_price_history(cursor, history_rows):
+    # part of the products batch's transaction, committed by the caller
+    if history_rows:
+        # executemany batches these into multi-row INSERTs
+        cursor.executemany("""INSERT IGNORE INTO price_history (product_id, observed_at, original_price, discounted_price, previous_price, is_drop)
+                              VALUES (%s, %s, %s, %s, %s, %s)""", history_rows)
 
-def get_row_count():
+def iter_mysql_product_rows(fetch_size=10000):
+    try:
+        with get_connection() as connection:
+            if connection is None: raise Error("No connection available")
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT id, name, original_price, discounted_price, eans, full_url FROM products")
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    yield from rows
+    except Error as e:
+        logger.error(f"Error reading products: {e}")
+
+def get_mysql_row_count():
     try:
         with get_connection() as connection:
             if connection is None: raise Error("No connection available")
@@ -116,4 +346,50 @@ def get_row_count():
                 return count
     except Error as e:
         logger.error(f"Error getting row count: {e}")
-        return None  # Return None to indicate failure
\ No newline at end of file
+        return None  # Return None to indicate failure
+
+
+class MySQLBackend(StorageBackend):
+    name = "mysql"
+
+    def setup(self):
+        setup_mysql_database()
+
+    def save_products(self, product_infos, history_rows=()):
+        return save_mysql_products(product_infos, history_rows)
+
+    def iter_product_rows(self, fetch_size=10000):
+        return iter_mysql_product_rows(fetch_size)
+
+    def row_count(self):
+        return get_mysql_row_count()
+
+storage_backend = None
+backend_lock = threading.Lock()
+
+def get_storage_backend():
+    global storage_backend
+    with backend_lock:
+        if storage_backend is None:
+            storage_config = config.get('storage', {})
+            if STORAGE_BACKEND == "sqlite":
+                storage_backend = SQLiteBackend(storage_config.get('sqlite_file', 'products.sqlite3'), price_history_enabled, DEALS_ENABLED, DEALS_MIN_DISCOUNT)
+            elif STORAGE_BACKEND == "columnar":
+                storage_backend = ColumnarSnapshotBackend(storage_config.get('snapshot_dir', 'snapshots'))
+            elif STORAGE_BACKEND == "mysql":
+                storage_backend = MySQLBackend()
+            else:
+                raise ValueError(f"Unknown storage backend {STORAGE_BACKEND!r}. Must be 'mysql', 'sqlite' or 'columnar'.")
+    return storage_backend
+
+def setup_database():
+    get_storage_backend().setup()
+
+def iter_product_rows(fetch_size=10000):
+    return get_storage_backend().iter_product_rows(fetch_size)
+
+def get_row_count():
+    return get_storage_backend().row_count()
+
+def close_storage():
+    get_storage_backend().close()
@@ -0,0 +1,56 @@
+"""
+Per-run set of product ids that have already been parsed.
+The same product_uid comes back from many category ids and again from the
+name searches; the parser stage drops repeats before they are parsed, queued
+and written again. Ids are kept as ints (numeric uids directly, anything else
+as a 64-bit hash) in lock-sharded sets so parser threads rarely contend.
+"""
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+HASHED_KEY_BIT = 1 << 63  # keeps hashed ids apart from numeric ones
+
+def product_key(product_uid):
+    uid = str(product_uid)
+    if uid.isdigit() and len(uid) < 19:
+        return int(uid)
+    return int.from_bytes(hashlib.blake2b(uid.encode('utf-8'), digest_size=8).digest(), 'little') | HASHED_KEY_BIT
+
+class SeenProducts:
+    def __init__(self, num_shards=16):
+        self.shards = [set() for _ in range(num_shards)]
+        self.locks = [threading.Lock() for _ in range(num_shards)]
+        self.duplicates = 0
+        self.stats_lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def first_seen(self, product_uids):
+        # returns one bool per uid: True the first time a uid is seen this run (missing uids always pass)
+        keep = [True] * len(product_uids)
+        by_shard = {}
+        for i, uid in enumerate(product_uids):
+            if uid is None:
+                continue
+            key = product_key(uid)
+            by_shard.setdefault(key % len(self.shards), []).append((i, key))
+        duplicates = 0
+        for shard_index, entries in by_shard.items():
+            shard = self.shards[shard_index]
+            with self.locks[shard_index]:
+                for i, key in entries:
+                    if key in shard:
+                        keep[i] = False
+                        duplicates += 1
+                    else:
+                        shard.add(key)
+        if duplicates:
+            with self.stats_lock:
+                self.duplicates += duplicates
+        return keep
+
+seen_products = SeenProducts()
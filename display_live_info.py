@@ -1,20 +1,31 @@
 import time
-import toml
 import threading
+from app_config import get_config
 
 #initialize global variables
-config = toml.load('config.toml')
-threadLock = threading.Lock()
+config = get_config()
 start_time = None
 output_dictionary = {}
-last_print_time = 0
-# Global counters
-category_counter = 0
-product_counter = 0
-#intialize how many categories there are in total
-num_categories = len(open(config.get('files', {}).get('category_ids_file')).readlines())
-if config.get('features', {}).get('process_category_names') == True:
-    num_categories += len(open(config.get('files', {}).get('category_names_file')).readlines())
+# Counters are sharded per thread: each thread only ever bumps its own dict, so counting
+# takes no lock, and the renderer thread sums the shards when it redraws.
+counter_shards = []
+shards_lock = threading.Lock() # only taken when a thread registers its shard
+local_counters = threading.local()
+renderer_stop = threading.Event()
+renderer_thread = None
+num_categories = None # counted from the category files on the first redraw, not at import
+
+def count_lines(file_path):
+    with open(file_path, 'r') as f:
+        return sum(1 for _ in f)
+
+def total_categories():
+    global num_categories
+    if num_categories is None:
+        num_categories = count_lines(config.get('files', {}).get('category_ids_file'))
+        if config.get('features', {}).get('process_category_names') == True:
+            num_categories += count_lines(config.get('files', {}).get('category_names_file'))
+    return num_categories
 
 def start_and_end_time():
     global start_time
@@ -27,16 +38,22 @@ def start_and_end_time():
         start_time = None  # Reset for the next call
         return start_time, elapsed_time, end_time
 
-def calculate_counters(counter_type):
-    with threadLock:
-        global category_counter, product_counter  # Declare global counters
+def calculate_counters(counter_type, amount=1):
+    shard = getattr(local_counters, 'shard', None)
+    if shard is None:
+        shard = local_counters.shard = {"categories": 0, "products": 0}
+        with shards_lock:
+            counter_shards.append(shard)
+    shard[counter_type] += amount
 
-        if counter_type == "categories":
-            category_counter += 1
-            display_counters(counter_type,category_counter)
-        elif counter_type == "products": 
-            product_counter += 1
-            display_counters(counter_type,product_counter)
+def counter_totals():
+    totals = {"categories": 0, "products": 0}
+    with shards_lock:
+        shards = list(counter_shards)
+    for shard in shards:
+        for counter_type, value in shard.items():
+            totals[counter_type] += value
+    return totals
 
 def getProgressBar (iteration, counter_type, total, suffix, length = 50):
     percent = ("{0:." + "1" + "f}").format(100 * (iteration / float(total)))
@@ -45,23 +62,26 @@ def getProgressBar (iteration, counter_type, total, suffix, length = 50):
     return f'\r\033[?25l{counter_type} processed Progress:|{bar}| {percent}% {suffix}'
 
 def display_counters(counter_type, counter_value):
-    global output_dictionary, last_print_time
+    global output_dictionary
 
+    elapsed_time = max(time.time() - start_time, 1e-6)
     if counter_type == "categories":
-        global num_categories
-        progress_bar = f"{getProgressBar(counter_value, counter_type, num_categories, 'Complete', length=50)} || {counter_value:,} categories processed: {round(counter_value/(time.time()-start_time)):,} categories/sec"
+        progress_bar = f"{getProgressBar(counter_value, counter_type, total_categories(), 'Complete', length=50)} || {counter_value:,} categories processed: {round(counter_value/elapsed_time):,} categories/sec"
         output_dictionary[counter_type] = progress_bar  
 
     elif counter_type == "products":
-        elapsed_time = time.time() - start_time
         minutes, seconds = divmod(elapsed_time, 60)
         product_info = f'total products processed: {counter_value:,} || {round(counter_value/elapsed_time):,} products/sec || elapsed time: {int(minutes)}m{int(seconds)}s'
         output_dictionary[counter_type] = product_info 
-      
-    current_time = time.time()
-    if current_time - last_print_time < 0.5:
-        return  # Don't print yet
-    last_print_time = current_time
+
+def render_progress():
+    if start_time is None:
+        return
+    for counter_type, value in counter_totals().items():
+        if value:
+            display_counters(counter_type, value)
+    if not output_dictionary:
+        return
 
     max_len = 0
     for key, value in output_dictionary.items():
@@ -70,3 +90,20 @@ def display_counters(counter_type, counter_value):
     print("\033[F" * len(output_dictionary), end="")
     for key, value in output_dictionary.items():
         print(value.ljust(max_len))
+
+def start_progress_renderer(interval=0.5):
+    # samples the counters at a fixed rate, so the hot paths never format or print anything
+    global renderer_thread
+    renderer_stop.clear()
+    def render_loop():
+        while not renderer_stop.wait(interval):
+            render_progress()
+        render_progress() # final totals
+    renderer_thread = threading.Thread(target=render_loop, daemon=True, name="Progress-Renderer")
+    renderer_thread.start()
+    return renderer_thread
+
+def stop_progress_renderer():
+    renderer_stop.set()
+    if renderer_thread is not None:
+        renderer_thread.join()
@@ -1,10 +1,8 @@
 import logging
 import sys
-import toml
+from app_config import get_config
 
-# Load configuration from config.toml
-with open('config.toml', 'r') as f:
-    config = toml.load(f)
+config = get_config()
 
 def setup_logging(console_level=logging.CRITICAL, file_level=logging.DEBUG, log_file='app.log'):
     logger = logging.getLogger()
@@ -1,104 +1,187 @@
+import argparse
 import logging
 import sys
 import threading
 import time
 from queue import Queue
-import toml
 from logging_config import setup_logging
-from db_handler import setup_database, get_row_count
-from thread_handler import (start_fetcher_threads, start_parser_threads, start_db_consumer, start_category_name_saver_thread, raw_data_queue, parsed_product_queue, category_names_process_queue)
+from db_handler import setup_database, get_row_count, iter_product_rows, close_storage
+from change_index import load_change_index, save_change_index
+from price_alerts import load_price_baseline, alerts_enabled
+from thread_handler import (write_daily_snapshot, start_fetcher_threads, start_parser_threads, start_db_consumer, start_category_name_saver_thread, start_price_drop_detector_thread, start_cache_replay_thread, stop_parser_pool, close_stage, page_flush_listeners, raw_data_queue, parsed_product_queue, category_names_process_queue)
 from obtain_recent_categories import get_category_ids
-from display_live_info import start_time, start_and_end_time
+from response_cache import response_cache, cache_mode
+from display_live_info import start_and_end_time, start_progress_renderer, stop_progress_renderer
+from pipeline_queue import queue_report
+from category_stats import category_stats
+from progress_journal import journal
+from work_broker import broker, LeasedWorkQueue, start_lease_heartbeat, worker_id, use_worker_files, local_path
+from metrics import start_metrics_server, write_metrics_summary
+from app_config import get_config
 
 
 logger = logging.getLogger(__name__)
 
-with open('config.toml', 'r') as f:
-    config = toml.load(f)
+config = get_config()
 
 #set scraping options    
 fetch_new_ids = config.get('features', {}).get('fetch_new_category_ids')  # Default to True if not specified
 save_names = config.get('features', {}).get('save_category_names')
 process_names = config.get('features', {}).get('process_category_names') 
+owner = worker_id() # identifies this process's leases in --worker mode
 
 
 def read_category_ids(file_path):
     if fetch_new_ids:
         get_category_ids() #get the new updated category ids
-    category_queue = Queue()
+    category_ids = []
     try:
         with open(file_path, 'r') as file:
             for line in file:
-                category_queue.put(int(line.strip()))
+                category_ids.append(int(line.strip()))
     except FileNotFoundError:
         logger.error(f"Category file {file_path} not found.")
         sys.exit(1)
     except ValueError:
         logger.error(f"Invalid category ID format in {file_path}.")
         sys.exit(1)
-    return category_queue
+    completed = journal.completed_terms("id") # only non-empty when resuming
+    return [category_id for category_id in category_stats.schedule(category_ids, "id") if str(category_id) not in completed]
 
-def main():
+def read_category_names(file_path):
+    try:
+        with open(file_path, 'r') as f:
+            category_names = [line.strip() for line in f]
+    except FileNotFoundError:
+        logger.warning(f"Category names file {file_path} not found.")  # Warning instead of sys.exit
+        return []
+    completed = journal.completed_terms("name")
+    return [category_name for category_name in category_stats.schedule(category_names, "name") if category_name not in completed]
+
+def run_coordinator():
+    # splits the crawl into work units for --worker processes and exits
     setup_logging()
+    category_stats.load()
+    category_stats.save()  # folds the previous workers' stats files into the shared one
+    category_ids = read_category_ids(config.get('files', {}).get('category_ids_file'))
+    category_names = read_category_names(config.get('files', {}).get('category_names_file')) if process_names else []
+    broker.reset()
+    broker.populate("id", category_ids)
+    broker.populate("name", category_names)
+    print(f"Queued {len(category_ids):,} category ids and {len(category_names):,} category names in {broker.path}.")
+
+def complete_leased_terms(page_refs):
+    # called by the DB consumer after each flush: a unit is done once every one of its pages is saved
+    for search_by, search_term in {(search_by, search_term) for search_by, search_term, _ in page_refs}:
+        if journal.term_complete(search_by, search_term):
+            broker.complete(search_by, search_term, owner)
+
+def main(resume=False, worker=False):
+    if worker:
+        use_worker_files(owner)
+    setup_logging(log_file=local_path('app.log'))  # app.<worker id>.log in --worker mode, so workers don't truncate each other's log
     setup_database()
+    load_change_index(iter_product_rows)
+    load_price_baseline(iter_product_rows)  # after the change index, which it can copy prices from
     print("\033[38;5;208mWelcome to the Sainsbury's Scraper\033[0m")
     start_time = start_and_end_time()
     print('Start time:', time.strftime('%H:%M:%S', time.gmtime(start_time)),'\n\n')
+    start_progress_renderer(config.get('processing', {}).get('progress_interval', 0.5))
+    metrics_server = start_metrics_server()
 
 
-    category_ids_file = config.get('files', {}).get('category_ids_file')
-    category_queue = read_category_ids(category_ids_file)
-
     num_fetcher_threads = config.get('processing',{}).get('num_fetcher_threads')
     num_parser_threads = config.get('processing',{}).get('num_parser_threads')
+    fetch_mode = config.get('processing', {}).get('fetch_mode', 'threads')
 
-
-    fetcher_threads = start_fetcher_threads(category_queue, category_names_process_queue, num_fetcher_threads) # Pass the new queue
+    if cache_mode == "replay":
+        # feed previously recorded pages through the pipeline without touching the API
+        fetcher_threads = [start_cache_replay_thread()]
+    else:
+        if cache_mode == "record":
+            response_cache.prune()
+        category_stats.load()
+        journal.open(resume) # without --resume this starts a fresh journal
+        if worker:
+            # take work units from the shared broker instead of the local files
+            category_queue = LeasedWorkQueue(broker, "id", owner)
+            category_names_queue = LeasedWorkQueue(broker, "name", owner)
+            page_flush_listeners.append(complete_leased_terms)
+            stop_heartbeat = threading.Event()
+            start_lease_heartbeat(broker, owner, stop_heartbeat)
+        else:
+            category_queue = Queue()
+            for category_id in read_category_ids(config.get('files', {}).get('category_ids_file')):
+                category_queue.put(category_id)
+
+            # Populate category_names_process_queue *before* starting the fetchers so they never see it empty too early
+            category_names_queue = category_names_process_queue
+            if process_names:
+                for category_name in read_category_names(config.get('files', {}).get('category_names_file')):
+                    category_names_queue.put(category_name)
+
+        if fetch_mode == "async":
+            from async_fetcher import start_async_fetcher
+            concurrency = config.get('processing', {}).get('async_concurrency', 64)
+            fetcher_threads = start_async_fetcher(category_queue, category_names_queue, concurrency)
+        else:
+            fetcher_threads = start_fetcher_threads(category_queue, category_names_queue, num_fetcher_threads) # Pass the new queue
     parser_threads = start_parser_threads(num_parser_threads)
     if save_names:
         category_saver_thread = start_category_name_saver_thread()
+    if alerts_enabled:
+        price_alert_thread = start_price_drop_detector_thread()
     db_consumer_thread = threading.Thread(target=start_db_consumer, daemon=True, name="DB-Consumer")
     db_consumer_thread.start()
 
 
-    # Populate category_names_process_queue *after* starting fetcher threads and *before* they finish
-    if process_names:
-        category_names_file = config.get('files', {}).get('category_names_file')
-        try:
-            with open(category_names_file, 'r') as f:
-                for line in f:
-                    category_names_process_queue.put(line.strip())
-        except FileNotFoundError:
-            logger.warning(f"Category names file {category_names_file} not found.")  # Warning instead of sys.exit
-
-
-    # Wait for all fetcher threads (both ID and name processing)
-    for thread in fetcher_threads:
-        thread.join()
-
-    # Signal parser threads to stop *after* all fetching is done
-    for _ in range(num_parser_threads):
-        raw_data_queue.put(None)
-    
-    for thread in parser_threads:
-        thread.join()
-
-
-    # Wait for any remaining items in parsed_product_queue to be processed
-    while not parsed_product_queue.empty():
-        time.sleep(1)
-
-    # Now it's safe to save the category names because all processing is finished.
-    category_saver_thread.join()  # Wait for the category saver thread to finish
-
+    # End of stream flows down the stages: fetchers -> parsers -> DB consumer -> category saver and price alerts.
+    # Each stage gets its None sentinel(s) as soon as the stage above has fully finished.
+    close_stage(fetcher_threads, raw_data_queue, len(parser_threads))
+    close_stage(parser_threads, parsed_product_queue)
+    stop_parser_pool()
+    db_consumer_thread.join() # returns once the last batch is committed, then signals the category saver and price alerts
+    if save_names:
+        category_saver_thread.join()
+    if alerts_enabled:
+        price_alert_thread.join()
+
+    if worker:
+        stop_heartbeat.set()
+        broker.release_unfinished(owner)
+        logger.info(f"Work units: {broker.summary()}")
+    journal.close()
+    if not worker:
+        save_change_index()  # a worker only saw its share of the products
+    if cache_mode != "replay":
+        category_stats.save()
     row_count = get_row_count()
     if row_count is not None:
         logger.info(f"Table 'products' has {row_count} rows.")
     else:
         logger.warning("Could not retrieve row count.")
+    close_storage() # the columnar backend writes its snapshot here
+    if worker:
+        logger.info("Daily snapshot skipped: a worker only saw its share of the products.")
+    else:
+        write_daily_snapshot()
+    stop_progress_renderer()
     _, elapsed_time, end_time = start_and_end_time()
-    print(f"Application Summary: \n Time taken: {time.strftime('%H:%M:%S', time.gmtime(elapsed_time))}\n Unique Products Saved: {row_count}\n Goodbye!")
+    memory_summary = '\n  '.join(queue_report())
+    metrics_file = write_metrics_summary(elapsed_time)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    print(f"Application Summary: \n Time taken: {time.strftime('%H:%M:%S', time.gmtime(elapsed_time))}\n Unique Products Saved: {row_count}\n Peak memory by stage:\n  {memory_summary}\n Stage metrics: {metrics_file}\n Goodbye!")
     logger.info("All products processed. Application finished.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sainsbury's product scraper")
+    parser.add_argument('--resume', action='store_true', help="skip categories and pages the interrupted previous run already saved")
+    role = parser.add_mutually_exclusive_group()
+    role.add_argument('--coordinator', action='store_true', help="split the crawl into work units in the shared broker and exit")
+    role.add_argument('--worker', action='store_true', help="fetch, parse and save work units leased from the shared broker")
+    args = parser.parse_args()
+    if args.coordinator:
+        run_coordinator()
+    else:
+        main(resume=args.resume, worker=args.worker)
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""
+Per-stage metrics for the scraper.
+Counters, gauges and histograms are kept in process and exposed in the
+Prometheus text format on a local HTTP endpoint (/metrics) while the run is
+going, and main dumps a JSON summary of them when the run ends.
+"""
+import bisect
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pipeline_queue import all_queues
+from rate_limiter import controller
+from work_broker import local_path
+from app_config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+metrics_config = config.get('metrics', {})
+
+def format_labels(label_names, label_values):
+    if not label_names:
+        return ""
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(label_names, label_values))
+    return f"{{{pairs}}}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self.values = {}
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return dict(self.values)
+
+    def render(self):
+        return self.header() + [f"{self.name}{format_labels(self.label_names, labels)} {value}" for labels, value in self.samples().items()]
+
+    def summary(self):
+        samples = self.samples()
+        if not self.label_names:
+            return samples.get((), 0)
+        return {','.join(map(str, labels)): value for labels, value in samples.items()}
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, label_names=(), function=None):
+        super().__init__(name, help_text, label_names)
+        self.values = {}
+        self.function = function  # called at scrape time and returns {label_values: value}
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def samples(self):
+        if self.function is not None:
+            return self.function()
+        with self.lock:
+            return dict(self.values)
+
+    render = Counter.render
+    summary = Counter.summary
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self.buckets = sorted(buckets)
+        self.series = {}  # label_values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+        for labels, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], values[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names + ('le',), labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {values[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+    def summary(self):
+        with self.lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+        result = {}
+        for labels, values in series.items():
+            count = sum(values[:-1])
+            result[','.join(map(str, labels)) or 'all'] = {
+                'count': count,
+                'sum': round(values[-1], 4),
+                'mean': round(values[-1] / count, 4) if count else None,
+                'p50': self.quantile(values, count, 0.5),
+                'p95': self.quantile(values, count, 0.95),
+            }
+        return result
+
+    def quantile(self, values, count, q):
+        # upper bound of the bucket the quantile falls in
+        if not count:
+            return None
+        target = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + [float('inf')], values[:-1]):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bound
+        return None
+
+registry = []
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+BATCH_BUCKETS = [10, 100, 500, 1000, 2500, 5000, 10000, 50000]
+
+fetch_seconds = Histogram("scraper_fetch_seconds", "API request latency.", LATENCY_BUCKETS, ("search_by",))
+fetch_bytes = Counter("scraper_fetch_bytes_total", "Response body bytes downloaded (decompressed).")
+fetch_wire_bytes = Counter("scraper_fetch_wire_bytes_total", "Response body bytes as sent by the API (compressed when negotiated).")
+fetch_responses = Counter("scraper_fetch_responses_total", "API responses by HTTP status (or timeout/error).", ("status",))
+fetch_retries = Counter("scraper_fetch_retries_total", "API requests retried after a failure.")
+parsed_products = Counter("scraper_parsed_products_total", "Products parsed.")
+parse_seconds = Histogram("scraper_parse_page_seconds", "Wall time to decode and parse one page.", LATENCY_BUCKETS)
+parse_cpu_seconds = Counter("scraper_parse_cpu_seconds_total", "CPU time spent decoding and parsing pages.")
+db_batch_rows = Histogram("scraper_db_batch_rows", "Rows per product write.", BATCH_BUCKETS)
+db_commit_seconds = Histogram("scraper_db_commit_seconds", "Time to write and commit one product batch.", LATENCY_BUCKETS)
+price_drops = Counter("scraper_price_drops_total", "Price drops reported by the price alert stage.")
+price_checks_skipped = Counter("scraper_price_checks_skipped_total", "Products the DB consumer couldn't hand to a full price alert queue.")
+price_alerts_unsent = Counter("scraper_price_alerts_unsent_total", "Price drop events the webhook sender dropped or failed to post.")
+db_rows = Counter("scraper_db_rows_total", "Products handled by the DB consumer.", ("result",))
+# read at scrape time, so they cost nothing between scrapes
+queue_items = Gauge("scraper_queue_items", "Items waiting in each pipeline queue.", ("queue",),
+                    function=lambda: {(q.name,): q.qsize() for q in all_queues})
+queue_bytes = Gauge("scraper_queue_bytes", "Bytes waiting in each pipeline queue.", ("queue",),
+                    function=lambda: {(q.name,): q.bytes for q in all_queues})
+fetch_concurrency = Gauge("scraper_fetch_concurrency_limit", "Requests the AIMD controller currently allows in flight.",
+                          function=lambda: {(): round(controller.limit, 2)})
+
+def record_fetch(search_by, status, seconds, nbytes=0, wire_bytes=None):
+    fetch_seconds.observe(seconds, search_by)
+    fetch_responses.inc(1, str(status))
+    if nbytes:
+        fetch_bytes.inc(nbytes)
+        fetch_wire_bytes.inc(nbytes if wire_bytes is None else wire_bytes)
+
+def record_db_write(rows, seconds, ok):
+    db_batch_rows.observe(rows)
+    db_commit_seconds.observe(seconds)
+    db_rows.inc(rows, "written" if ok else "failed")
+
+def render_prometheus():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def metrics_summary(elapsed_seconds=None):
+    summary = {metric.name: metric.summary() for metric in registry}
+    if elapsed_seconds:
+        summary['products_per_second'] = round(parsed_products.summary() / elapsed_seconds, 1)
+        summary['elapsed_seconds'] = round(elapsed_seconds, 1)
+    return summary
+
+def write_metrics_summary(elapsed_seconds=None):
+    path = local_path(metrics_config.get('summary_file', 'metrics_summary.json'))
+    if not metrics_config.get('enabled', False) or not path:
+        return None
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(metrics_summary(elapsed_seconds), f, indent=2)
+    logger.info(f"Metrics summary written to {path}.")
+    return path
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep scrapes out of app.log
+
+def start_metrics_server():
+    port = metrics_config.get('port', 0)
+    if not metrics_config.get('enabled', False) or not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((metrics_config.get('host', '127.0.0.1'), port), MetricsHandler)
+    except OSError as e:
+        # e.g. another worker on this host already serves metrics on this port; the run itself doesn't need it
+        logger.warning(f"Metrics endpoint not started on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="Metrics-Server").start()
+    logger.info(f"Serving metrics on http://{server.server_address[0]}:{port}/metrics")
+    return server
@@ -1,6 +1,9 @@
 import requests
-import toml
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from catalogue_store import catalogue, append_lines
+from app_config import get_config
 
 logger = logging.getLogger(__name__)
 
@@ -31,28 +34,44 @@ def get_category_ids():
             for item in data:
                 extract_ids(item)
 
-    for url in api_urls:
+    def fetch_taxonomy(url):
+        # conditional GET: an unchanged taxonomy comes back as an empty 304
+        etag, last_modified = catalogue.validators(url)
+        conditional_headers = dict(headers)
+        if etag:
+            conditional_headers['If-None-Match'] = etag
+        if last_modified:
+            conditional_headers['If-Modified-Since'] = last_modified
         try:
-            response = requests.get(url, headers=headers)
+            response = requests.get(url, headers=conditional_headers, timeout=30)
+            if response.status_code == 304:
+                logger.info(f"Taxonomy unchanged since last sync: {url}")
+                return url, None, None
             response.raise_for_status()
-            extract_ids(response.json())
-        except requests.exceptions.RequestException as e:
-            print(f"API request failed for {url}: {e}")
+            return url, response.json(), response.headers
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"API request failed for {url}: {e}")
+            return url, None, None
 
-    config = toml.load("config.toml")
-    file_path = config["files"]["category_ids_file"]
-
-    existing_ids = set()
-    try:
-        with open(file_path, 'r') as f:
-            existing_ids.update(line.strip() for line in f)
-    except FileNotFoundError:
-        pass
+    catalogue.open()
+    sync_start = time.strftime('%Y-%m-%d %H:%M:%S')
+    with ThreadPoolExecutor(max_workers=len(api_urls)) as executor:
+        results = list(executor.map(fetch_taxonomy, api_urls))
 
-    all_ids = sorted([id for id in category_ids | existing_ids if id is not None])
+    config = get_config()
+    file_path = config["files"]["category_ids_file"]
+    new_ids = set()
+    for url, data, response_headers in results:
+        if data is None:
+            continue
+        category_ids.clear()
+        extract_ids(data)
+        new_ids |= catalogue.record("id", category_ids, url)
+        # only trust the validators once the ids they cover are in the store
+        catalogue.save_validators(url, response_headers.get('ETag'), response_headers.get('Last-Modified'))
+        dropped = catalogue.missing_since("id", url, sync_start)
+        if dropped:
+            logger.info(f"{len(dropped)} category IDs are no longer listed by {url}; kept in {file_path}.")
 
-    with open(file_path, 'w') as f:
-        f.writelines(f"{id}\n" for id in all_ids)
-    total_ids = len(all_ids)
-    added_ids = total_ids - len(existing_ids)
-    logging.info(f"Category IDs written to {file_path} \n {total_ids} total IDs, {added_ids} new IDs added.")
\ No newline at end of file
+    append_lines(file_path, new_ids, "id")
+    logging.info(f"Category IDs synced to {file_path} \n {catalogue.count('id')} total IDs, {len(new_ids)} new IDs added.")
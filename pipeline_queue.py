@@ -0,0 +1,109 @@
+"""
+Bounded queue for the pipeline stages.
+A MeteredQueue is a queue.Queue capped by item count and/or total bytes, so a
+slow consumer makes its producers block (backpressure) instead of letting
+memory grow. It also records peak items/bytes and how long producers waited.
+"""
+import logging
+import resource
+import sys
+import time
+from queue import Queue, Full
+
+logger = logging.getLogger(__name__)
+
+all_queues = []
+
+def estimate_size(item):
+    if item is None:
+        return 0
+    if isinstance(item, (bytes, bytearray, str)):
+        return len(item)
+    if isinstance(item, tuple):
+        return sum(estimate_size(part) for part in item)
+    if isinstance(item, list):
+        # parsed pages hold thousands of same-shaped records, so size the first and scale
+        return sys.getsizeof(item) + (estimate_size(item[0]) + sys.getsizeof(item[0])) * len(item) if item else sys.getsizeof(item)
+    if isinstance(item, dict):
+        return sys.getsizeof(item) + sum(sys.getsizeof(value) for value in item.values())
+    return sys.getsizeof(item)
+
+class MeteredQueue(Queue):
+    def __init__(self, name, maxsize=0, max_bytes=0, sizeof=estimate_size):
+        super().__init__(maxsize)
+        self.name = name
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.peak_items = 0
+        self.peak_bytes = 0
+        self.blocked_puts = 0
+        self.blocked_seconds = 0.0
+        all_queues.append(self)
+
+    def _over_budget(self, nbytes):
+        size = self._qsize()
+        if self.maxsize > 0 and size >= self.maxsize:
+            return True
+        # an item bigger than max_bytes still goes in once the queue is empty, otherwise it could never be queued
+        return self.max_bytes > 0 and size > 0 and self.bytes + nbytes > self.max_bytes
+
+    def put(self, item, block=True, timeout=None, nbytes=None):
+        if nbytes is None:
+            nbytes = self.sizeof(item)
+        with self.not_full:
+            if self._over_budget(nbytes):
+                if not block:
+                    raise Full
+                self.blocked_puts += 1
+                started = time.monotonic()
+                deadline = None if timeout is None else started + timeout
+                while self._over_budget(nbytes):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.blocked_seconds += time.monotonic() - started
+                        raise Full
+                    self.not_full.wait(remaining)
+                self.blocked_seconds += time.monotonic() - started
+            self._put((item, nbytes))
+            self.bytes += nbytes
+            self.peak_items = max(self.peak_items, self._qsize())
+            self.peak_bytes = max(self.peak_bytes, self.bytes)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def put_nowait(self, item, nbytes=None):
+        return self.put(item, block=False, nbytes=nbytes)
+
+    def _get(self):
+        item, nbytes = self.queue.popleft()
+        self.bytes -= nbytes
+        return item
+
+    def stats(self):
+        with self.mutex:
+            return {
+                'queue': self.name,
+                'items': self._qsize(),
+                'bytes': self.bytes,
+                'peak_items': self.peak_items,
+                'peak_bytes': self.peak_bytes,
+                'blocked_puts': self.blocked_puts,
+                'blocked_seconds': round(self.blocked_seconds, 2),
+            }
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def queue_report():
+    lines = []
+    for q in all_queues:
+        stats = q.stats()
+        line = f"{stats['queue']}: peak {stats['peak_items']:,} items / {stats['peak_bytes'] / 1048576:,.1f} MB, producers blocked {stats['blocked_puts']:,} times ({stats['blocked_seconds']}s)"
+        logger.info(f"Queue {line}")
+        lines.append(line)
+    lines.append(f"process peak RSS: {peak_rss_mb():,.1f} MB")
+    logger.info(f"Process peak RSS: {peak_rss_mb():,.1f} MB")
+    return lines
@@ -0,0 +1,158 @@
+"""
+Price drops spotted while the crawl is still running.
+The DB consumer hands every parsed page to the detector thread, which looks up
+each product's previous price in an in-memory baseline loaded at startup (the
+change index's prices, the latest columnar snapshot, or the products table)
+and emits an event for each drop that clears the thresholds. Events go to a
+JSONL file, written in the detector thread, and, if webhook_url is set, POSTed
+as {"events": [...]} once per page from a sender thread of their own;
+benchmarks/webhook_receiver.py is a local stand-in for testing.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+import requests
+from change_index import change_index, index_enabled, pack_prices, unpack_prices, effective_price
+from columnar_snapshot import list_snapshots, read_snapshot, from_fixed_point
+from metrics import price_drops as price_drops_metric, price_alerts_unsent
+from work_broker import local_path
+from app_config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+alert_config = config.get('price_alerts', {})
+alerts_enabled = alert_config.get('enabled', False)
+MIN_DROP_PERCENT = alert_config.get('min_drop_percent', 10.0)
+MIN_DROP_AMOUNT = alert_config.get('min_drop_amount', 0.0)
+
+baseline = {}  # product id -> pack_prices(original, discounted) from before this run
+
+def load_snapshot_prices(directory):
+    columns = read_snapshot(directory)
+    return {product_id: pack_prices(from_fixed_point(original), from_fixed_point(discounted))
+            for product_id, original, discounted in zip(columns['id'], columns['original_price'], columns['discounted_price'])}
+
+def load_price_baseline(iter_product_rows):
+    # "auto" reuses the change index when it's loaded anyway, then the newest snapshot, then the products table
+    if not alerts_enabled:
+        return
+    global baseline
+    start_time = time.time()
+    source = alert_config.get('source', 'auto')
+    snapshots = list_snapshots(config.get('storage', {}).get('snapshot_dir', 'snapshots'))
+    if source == "index" or (source == "auto" and index_enabled):
+        baseline = dict(change_index.prices)  # a copy, the index moves on as batches are committed
+        source = "change index"
+    elif source == "snapshot" or (source == "auto" and snapshots):
+        baseline = load_snapshot_prices(snapshots[-1]) if snapshots else {}
+        source = snapshots[-1] if snapshots else "no snapshot"
+    else:
+        baseline = {row[0]: pack_prices(row[2], row[3]) for row in iter_product_rows()}
+        source = "products table"
+    logger.info(f"Price alerts: loaded {len(baseline):,} previous prices from {source} in {time.time() - start_time:.1f}s.")
+
+def find_drops(products, detected_at):
+    events = []
+    for product in products:
+        previous = baseline.get(product.id)
+        packed = pack_prices(product.original_price, product.discounted_price)
+        baseline[product.id] = packed  # a product seen again this run is compared with this price, so one drop isn't reported twice
+        if previous is None or previous == packed:
+            continue
+        previous_price = effective_price(*unpack_prices(previous))
+        price = effective_price(product.original_price, product.discounted_price)
+        if previous_price is None or price is None or price >= previous_price:
+            continue
+        drop = round(previous_price - price, 2)
+        drop_percent = round(drop / previous_price * 100, 1)
+        if drop_percent < MIN_DROP_PERCENT or drop < MIN_DROP_AMOUNT:
+            continue
+        events.append({'id': product.id, 'name': product.name, 'previous_price': previous_price, 'price': price,
+                       'drop': drop, 'drop_percent': drop_percent, 'full_url': product.full_url, 'detected_at': detected_at})
+    return events
+
+class JsonlSink:
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def emit(self, events):
+        self.file.writelines(json.dumps(event) + '\n' for event in events)
+        self.file.flush()  # so a tail -f sees drops as they happen
+
+    def close(self):
+        self.file.close()
+
+class WebhookSink:
+    # posts from its own thread, so a slow or unresponsive webhook never holds up the detector;
+    # when its queue is full events are dropped (and counted), the JSONL file is the complete record
+    def __init__(self, url, timeout=5, max_pending=100):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.failures = 0
+        self.thread = threading.Thread(target=self.send_events, daemon=True, name="Price-Alert-Webhook")
+        self.thread.start()
+
+    def emit(self, events):
+        try:
+            self.pending.put_nowait(events)
+        except queue.Full:
+            price_alerts_unsent.inc(len(events))
+
+    def send_events(self):
+        while True:
+            events = self.pending.get()
+            if events is None:
+                break
+            try:
+                self.session.post(self.url, json={'events': events}, timeout=self.timeout).raise_for_status()
+            except requests.exceptions.RequestException as e:
+                self.failures += 1
+                price_alerts_unsent.inc(len(events))
+                logger.warning(f"Price alert webhook failed for {len(events)} events: {e}")
+
+    def close(self, wait=30):
+        # gives queued posts a bounded time to go out, so a dead webhook can't hold up the end of the run
+        try:
+            self.pending.put(None, timeout=wait)
+            self.thread.join(wait)
+        except queue.Full:
+            pass
+        if self.thread.is_alive():
+            logger.warning(f"Price alert webhook: gave up on {self.pending.qsize()} queued posts at shutdown.")
+        if price_alerts_unsent.summary():
+            logger.warning(f"Price alert webhook: {price_alerts_unsent.summary():,} events not delivered ({self.failures} failed posts), "
+                           f"see the JSONL file for every drop.")
+        self.session.close()
+
+def open_sinks():
+    sinks = []
+    if alert_config.get('jsonl_file', 'price_drops.jsonl'):
+        sinks.append(JsonlSink(local_path(alert_config.get('jsonl_file', 'price_drops.jsonl'))))
+    if alert_config.get('webhook_url'):
+        sinks.append(WebhookSink(alert_config['webhook_url'], alert_config.get('webhook_timeout', 5)))
+    return sinks
+
+def detect_price_drops(price_check_queue, sinks=None):
+    sinks = open_sinks() if sinks is None else sinks
+    total = 0
+    logger.info("Price drop detector thread started.")
+    while True:
+        products = price_check_queue.get()
+        price_check_queue.task_done()
+        if products is None:
+            break  # end of stream, queued by the DB consumer
+        events = find_drops(products, time.strftime('%Y-%m-%dT%H:%M:%S'))
+        if not events:
+            continue
+        total += len(events)
+        price_drops_metric.inc(len(events))
+        for sink in sinks:
+            sink.emit(events)
+    for sink in sinks:
+        sink.close()
+    logger.info(f"Price drop detector thread finished: {total:,} price drops reported.")
@@ -0,0 +1,100 @@
+"""
+Durable progress journal so an interrupted run can be resumed with --resume.
+Every fetched page travels through the pipeline with a (search_by, term, page)
+reference, and the parser queues a page's products together with it. Once the
+DB consumer has committed the batch holding a page's products the page is
+journaled as flushed. Pages are only recorded
+once their rows are in the database, so a resume re-fetches exactly the
+pages whose rows were still in flight.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from work_broker import local_path
+from app_config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+class ProgressJournal:
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()
+        self.resuming = False
+
+    def open(self, resume=False):
+        path = local_path(self.path)  # each --worker keeps its own journal
+        if not resume and os.path.exists(path):
+            os.remove(path)
+        self.resuming = resume
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS terms (search_by TEXT, term TEXT, pages INTEGER, page_size INTEGER, PRIMARY KEY (search_by, term));
+            CREATE TABLE IF NOT EXISTS flushed_pages (search_by TEXT, term TEXT, page INTEGER, PRIMARY KEY (search_by, term, page));
+            CREATE TABLE IF NOT EXISTS batches (id INTEGER PRIMARY KEY, flushed_at TEXT DEFAULT CURRENT_TIMESTAMP, rows INTEGER, pages INTEGER);
+        ''')
+        self.connection.commit()
+        if resume:
+            terms, pages, batches = self.connection.execute('''SELECT (SELECT COUNT(*) FROM terms), (SELECT COUNT(*) FROM flushed_pages),
+                                                               (SELECT COUNT(*) FROM batches)''').fetchone()
+            logger.info(f"Resuming from {path}: {terms:,} terms started, {pages:,} pages and {batches:,} batches already flushed.")
+
+    def close(self):
+        if self.connection is not None:
+            with self.lock:
+                self.connection.commit()
+                self.connection.close()
+                self.connection = None
+            path = local_path(self.path)
+            if path != self.path:
+                # a worker's unfinished units go back to the broker, so its journal isn't needed after a clean finish
+                for leftover in (path, f"{path}-wal", f"{path}-shm"):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+
+    def record_term(self, search_by, search_term, pages, page_size):
+        # committed together with the next flush, so a crash can't leave a page marked without its term
+        # page_size is kept so a resume asks for the same pages even if the size picked for the term has changed since
+        if self.connection is None:
+            return
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO terms VALUES (?, ?, ?, ?)", (search_by, str(search_term), pages, page_size))
+
+    def mark_flushed(self, page_refs, rows):
+        if self.connection is None:
+            return
+        with self.lock:
+            self.connection.executemany("INSERT OR IGNORE INTO flushed_pages VALUES (?, ?, ?)",
+                                        [(search_by, str(search_term), page) for search_by, search_term, page in page_refs])
+            self.connection.execute("INSERT INTO batches (rows, pages) VALUES (?, ?)", (rows, len(page_refs)))
+            self.connection.commit()
+
+    def completed_terms(self, search_by):
+        if not self.resuming:
+            return set()
+        with self.lock:
+            rows = self.connection.execute('''SELECT t.term FROM terms t JOIN flushed_pages p ON p.search_by = t.search_by AND p.term = t.term
+                                              WHERE t.search_by = ? GROUP BY t.term, t.pages HAVING COUNT(*) >= t.pages''', (search_by,)).fetchall()
+        return {row[0] for row in rows}
+
+    def term_complete(self, search_by, search_term):
+        with self.lock:
+            row = self.connection.execute('''SELECT t.pages, COUNT(p.page) FROM terms t LEFT JOIN flushed_pages p ON p.search_by = t.search_by AND p.term = t.term
+                                             WHERE t.search_by = ? AND t.term = ? GROUP BY t.pages''', (search_by, str(search_term))).fetchone()
+        return row is not None and row[1] >= row[0]
+
+    def resume_state(self, search_by, search_term):
+        # (known page count or None, page size it was fetched with or None, pages already flushed) for a partly finished term
+        if not self.resuming:
+            return None, None, set()
+        with self.lock:
+            row = self.connection.execute("SELECT pages, page_size FROM terms WHERE search_by = ? AND term = ?", (search_by, str(search_term))).fetchone()
+            flushed = self.connection.execute("SELECT page FROM flushed_pages WHERE search_by = ? AND term = ?", (search_by, str(search_term))).fetchall()
+        known_pages, page_size = row if row else (None, None)
+        return known_pages, page_size, {page for (page,) in flushed}
+
+journal = ProgressJournal(config.get('files', {}).get('progress_journal_file', 'progress_journal.sqlite3'))
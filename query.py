@@ -1,20 +1,100 @@
 import requests
+from requests.adapters import HTTPAdapter
+import asyncio
+import math
+import threading
 import logging
+import re
 import time
-import toml
+from parser import decode_json
+from category_stats import category_stats
+from rate_limiter import bucket, controller, backoff_delay, SUCCESS, CONGESTION, FAILURE
+from metrics import record_fetch, fetch_retries
+from app_config import get_config
 
-with open('config.toml', 'r') as f:
-    config = toml.load(f)
+config = get_config()
 
 # Moved to config.toml under api settings
 max_retries = config.get("api", {}).get("max_retries")
 retry_delay = config.get("api", {}).get("retry_delay")
+request_timeout = config.get("api", {}).get("request_timeout", 60)
+backoff_cap = config.get("rate_limit", {}).get("backoff_cap", 300)
+
+PRODUCT_URL = config.get('api', {}).get('product_url', 'https://www.sainsburys.co.uk/groceries-api/gol-services/product/v1/product')
+
+# page_size is the largest page we ask for; with adaptive_page_size each category gets a size from its last run's stats
+ADAPTIVE_PAGE_SIZE = config.get('api', {}).get('adaptive_page_size', True)
+MIN_PAGE_SIZE = config.get('api', {}).get('min_page_size', 100)
+MAX_PAGE_SHRINKS = config.get('api', {}).get('max_page_shrinks', 1)  # times a timed-out page 1 is asked for again at half the size
+PAGE_SECONDS_TARGET = config.get('api', {}).get('page_seconds_target', request_timeout / 3)
+PAGE_HEADROOM = 1.1  # room for products added since the last run, so they don't spill onto an extra page
+
+class PageTimeout(Exception):
+    # raised instead of retrying when the caller would rather ask again for a smaller page
+    pass
 
 logger = logging.getLogger(__name__)
 
-def fetch_sainsburys_products(search_term, page_number, page_size, search_by="id"):
-    url = 'https://www.sainsburys.co.uk/groceries-api/gol-services/product/v1/product'
+# One keep-alive session shared by every fetcher thread, so pages reuse pooled
+# TCP/TLS connections instead of opening a new one per request. Created on first use.
+session = None
+session_lock = threading.Lock()
+
+def get_session():
+    global session
+    with session_lock:
+        if session is None:
+            pool_size = config.get('processing', {}).get('num_fetcher_threads', 10) + config.get('api', {}).get('max_page_fanout', 8)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)  # product_url can point at a local mock API
+    return session
+
+def load_aiohttp():
+    # aiohttp is only needed when fetch_mode = "async" and is slow to import, so it's loaded on demand
+    try:
+        import aiohttp
+    except ImportError:
+        return None
+    return aiohttp
+
+# "controls": {... "page": {... "last": N ...} ...}, with page a direct child of controls (other members may hold one level of nesting)
+LAST_PAGE_PATTERN = re.compile(rb'"controls"\s*:\s*\{(?:[^{}]|\{[^{}]*\})*?"page"\s*:\s*\{[^{}]*?"last"\s*:\s*(\d+)')
 
+def peek_last_page(content):
+    # pages travel through the pipeline undecoded, so pull controls.page.last out of the raw body,
+    # trying "controls" occurrences from the end (the real block follows the products) until one has the
+    # expected shape, and only fall back to a full decode if none does
+    controls = content.rfind(b'"controls"')
+    while controls != -1:
+        match = LAST_PAGE_PATTERN.match(content, controls)
+        if match:
+            return int(match.group(1))
+        controls = content.rfind(b'"controls"', 0, controls)
+    return decode_json(content).get('controls', {}).get('page', {}).get('last') or 1
+
+def count_products(content):
+    # cheap estimate for the scheduler's stats: every product carries exactly one product_uid key
+    return content.count(b'"product_uid"')
+
+def choose_page_size(search_by, search_term, max_page_size):
+    # small categories get one right-sized page, slow ones get pages small enough to come back well inside the timeout
+    entry = category_stats.get(search_by, search_term)
+    if not ADAPTIVE_PAGE_SIZE or not entry or not entry.get('products'):
+        return max_page_size
+    limit = max_page_size
+    if entry.get('page_seconds') and entry.get('page_size'):
+        seconds_per_product = entry['page_seconds'] / min(entry['page_size'], entry['products'])
+        limit = min(limit, int(PAGE_SECONDS_TARGET / seconds_per_product))
+    expected = math.ceil(entry['products'] * PAGE_HEADROOM)
+    pages = math.ceil(expected / max(limit, MIN_PAGE_SIZE))
+    return max(MIN_PAGE_SIZE, min(max_page_size, math.ceil(expected / pages)))
+
+def smaller_page_size(page_size):
+    return max(MIN_PAGE_SIZE, page_size // 2)
+
+def build_request(search_term, page_number, page_size, search_by="id"):
     if search_by == "id":
         params = {
             'filter[keyword]': '',
@@ -34,8 +114,8 @@ def fetch_sainsburys_products(search_term, page_number, page_size, search_by="id
     elif search_by == "name":
         params = {
             'filter[keyword]': search_term,
-            'page_number': page_number,
-            'page_size': page_size,
+            'page_number': str(page_number),
+            'page_size': str(page_size),
             'include[CANNED]': 'true'
         }
         headers = {
@@ -46,24 +126,107 @@ def fetch_sainsburys_products(search_term, page_number, page_size, search_by="id
         }
     else:
         raise ValueError("Invalid search_by argument. Must be 'id' or 'name'.")
+    return params, headers
+
+def parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None  # missing, or an HTTP date we don't bother parsing
+
+def classify_status(status_code):
+    # 429 and 5xx mean the API is overloaded, other 4xx won't change on retry
+    if status_code == 429 or status_code >= 500:
+        return CONGESTION
+    return FAILURE
+
+def fetch_sainsburys_products(search_term, page_number, page_size, search_by="id", raise_on_timeout=False):
+    params, headers = build_request(search_term, page_number, page_size, search_by)
 
     for attempt in range(1, max_retries + 1):
+        wait = bucket.reserve()
+        if wait:
+            time.sleep(wait)
+        controller.acquire()
+        outcome, latency, retry_after = FAILURE, None, None
+        status, nbytes, wire_bytes = "error", 0, None
+        started = time.monotonic()
         try:
-            response = requests.get(url, headers=headers, params=params, timeout=60)
+            response = get_session().get(PRODUCT_URL, headers=headers, params=params, timeout=request_timeout)
+            status = response.status_code
             response.raise_for_status()
+            outcome, latency = SUCCESS, time.monotonic() - started
+            nbytes = len(response.content)
+            wire_bytes = int(response.headers.get('Content-Length', nbytes))
             return response
         except requests.exceptions.Timeout:
+            outcome, status = CONGESTION, "timeout"
             logger.debug(f"Request timed out for search term {search_term}, page {page_number}. Attempt {attempt}/{max_retries}")
-            if attempt < max_retries:
-                time.sleep(retry_delay*attempt)
-            else:
+            if raise_on_timeout:
+                raise PageTimeout(f"{search_term} page {page_number} with page_size {page_size}")
+        except requests.exceptions.HTTPError as e:
+            outcome = classify_status(e.response.status_code)
+            logger.warning(f"Request failed for search term {search_term}, page {page_number}. Attempt {attempt}/{max_retries}: {e}")
+            if outcome != CONGESTION:
                 return None
+            retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
         except requests.exceptions.RequestException as e:
             logger.warning(f"Request failed for search term {search_term}, page {page_number}. Attempt {attempt}/{max_retries}: {e}")
-            if attempt < max_retries:
-                time.sleep(retry_delay)
-            else:
-                logger.error(f"Max retries reached for search term {search_term}, page {page_number} NO SEARCH MADE.")
-                return None
+        finally:
+            controller.release(outcome, latency)
+            record_fetch(search_by, status, time.monotonic() - started, nbytes, wire_bytes)
+        # the in-flight slot is already released, so backing off doesn't hold up other requests; the fetcher
+        # thread itself does wait here (fetch_mode = "async" waits on the event loop instead)
+        if attempt < max_retries:
+            fetch_retries.inc()
+            time.sleep(backoff_delay(attempt, retry_delay, backoff_cap, retry_after))
+
+    logger.error(f"Max retries reached for search term {search_term}, page {page_number} NO SEARCH MADE.")
+    return None
+
+async def fetch_sainsburys_products_async(client, search_term, page_number, page_size, search_by="id", raise_on_timeout=False, timed=False):
+    # same retry policy as fetch_sainsburys_products, but returns the raw body
+    # because the response object can't outlive the aiohttp request context.
+    # timed=True returns (body, seconds the successful request took), the async stand-in for response.elapsed
+    aiohttp = load_aiohttp()
+    params, headers = build_request(search_term, page_number, page_size, search_by)
+
+    for attempt in range(1, max_retries + 1):
+        wait = bucket.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        await controller.acquire_async()
+        outcome, latency, retry_after = FAILURE, None, None
+        status, nbytes, wire_bytes = "error", 0, None
+        started = time.monotonic()
+        try:
+            async with client.get(PRODUCT_URL, headers=headers, params=params) as response:
+                status = response.status
+                response.raise_for_status()
+                content = await response.read()
+                wire_bytes = response.content_length  # aiohttp negotiates and decodes gzip/deflate (and br) itself
+            outcome, latency = SUCCESS, time.monotonic() - started
+            nbytes = len(content)
+            return (content, latency) if timed else content
+        except asyncio.TimeoutError:
+            outcome, status = CONGESTION, "timeout"
+            logger.debug(f"Request timed out for search term {search_term}, page {page_number}. Attempt {attempt}/{max_retries}")
+            if raise_on_timeout:
+                raise PageTimeout(f"{search_term} page {page_number} with page_size {page_size}")
+        except aiohttp.ClientResponseError as e:
+            outcome = classify_status(e.status)
+            logger.warning(f"Request failed for search term {search_term}, page {page_number}. Attempt {attempt}/{max_retries}: {e}")
+            if outcome != CONGESTION:
+                return (None, None) if timed else None
+            retry_after = parse_retry_after(e.headers.get('Retry-After') if e.headers else None)
+        except aiohttp.ClientError as e:
+            logger.warning(f"Request failed for search term {search_term}, page {page_number}. Attempt {attempt}/{max_retries}: {e}")
+        finally:
+            controller.release(outcome, latency)
+            record_fetch(search_by, status, time.monotonic() - started, nbytes, wire_bytes)
+        if attempt < max_retries:
+            fetch_retries.inc()
+            await asyncio.sleep(backoff_delay(attempt, retry_delay, backoff_cap, retry_after))
 
-    return None
\ No newline at end of file
+    logger.error(f"Max retries reached for search term {search_term}, page {page_number} NO SEARCH MADE.")
+    return (None, None) if timed else None
@@ -0,0 +1,145 @@
+"""
+Shared flow control for the Sainsbury's API.
+A token bucket caps the request rate, and an AIMD (additive-increase /
+multiplicative-decrease) controller decides how many requests may be in flight:
+it grows by one slot per window of healthy responses and halves on
+429/5xx/timeouts. Both are thread-safe and also usable from the async fetcher.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from app_config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+# outcomes reported back to the controller
+SUCCESS = "success"
+CONGESTION = "congestion"  # 429, 5xx or timeout: the API wants us to slow down
+FAILURE = "failure"  # anything else, says nothing about load
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate  # tokens per second, 0 disables the bucket
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # takes a token now and returns how long the caller has to wait before using it
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+class AIMDController:
+    def __init__(self, initial, minimum, maximum, latency_target=None, decrease_factor=0.5, cooldown=2.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown  # one cut per burst of failures, not one per failed request
+        self.in_flight = 0
+        self.latency_ewma = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+        self.async_waiters = []
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self.async_waiters.append((loop, waiter))
+            await waiter
+
+    def release(self, outcome, latency=None):
+        with self.condition:
+            self.in_flight -= 1
+            if outcome == SUCCESS:
+                self._on_success(latency)
+            elif outcome == CONGESTION:
+                self._decrease("API pushed back")
+            self.condition.notify_all()
+            waiters, self.async_waiters = self.async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake_waiter, waiter)
+
+    def _on_success(self, latency):
+        if latency is not None:
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        if self.latency_target and self.latency_ewma is not None:
+            if self.latency_ewma > 2 * self.latency_target:
+                self._decrease(f"latency {self.latency_ewma:.1f}s")
+                return
+            if self.latency_ewma > self.latency_target:
+                return  # hold steady while latency is above target
+        # +1 slot per `limit` successes, i.e. roughly one per round-trip
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def _decrease(self, reason):
+        now = time.monotonic()
+        if now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
+        logger.info(f"Concurrency limit cut to {int(self.limit)} ({reason}).")
+
+def _wake_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+def backoff_delay(attempt, base, cap, retry_after=None):
+    # "full jitter" exponential backoff so retries from many workers don't arrive together
+    if retry_after is not None:
+        return min(cap, retry_after) + random.uniform(0, base)
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+def fetch_capacity():
+    # most requests the fetchers can have in flight: page-1 fetcher threads plus the page fan-out pool,
+    # or the async concurrency cap
+    processing = config.get('processing', {})
+    if processing.get('fetch_mode', 'threads') == "async":
+        return processing.get('async_concurrency', 64)
+    return processing.get('num_fetcher_threads', 10) + config.get('api', {}).get('max_page_fanout', 8)
+
+def page_latency_target():
+    # query.choose_page_size sizes pages to take up to page_seconds_target, so a latency target below that
+    # would keep cutting concurrency on exactly the pages sized to it; 0 (the default) means page_seconds_target
+    api_config = config.get('api', {})
+    page_seconds_target = api_config.get('page_seconds_target', api_config.get('request_timeout', 60) / 3)
+    latency_target = rate_config.get('latency_target') or page_seconds_target
+    if api_config.get('adaptive_page_size', True):
+        return max(latency_target, page_seconds_target)
+    return latency_target
+
+rate_config = config.get('rate_limit', {})
+bucket = TokenBucket(rate_config.get('requests_per_second', 0), rate_config.get('burst', 20))
+# 0 (the default) means the fetchers' own capacity, so the controller starts where an unlimited run would
+# and only has to back off; a max_concurrency above the capacity could never be reached anyway
+max_concurrency = rate_config.get('max_concurrency') or fetch_capacity()
+controller = AIMDController(
+    initial=min(rate_config.get('initial_concurrency') or max_concurrency, max_concurrency),
+    minimum=rate_config.get('min_concurrency', 1),
+    maximum=max_concurrency,
+    latency_target=page_latency_target(),
+)
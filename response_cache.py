@@ -0,0 +1,110 @@
+"""
+On-disk record/replay cache of raw API pages.
+Each page is stored gzip-compressed under the sha256 of its request
+(search_by, term, page, page_size). In "record" mode every fetched page is
+written, and in "replay" mode the cached pages are fed straight into
+raw_data_queue so the parse/DB stages can be re-run without the network.
+A replay writes every cached product, even with change detection on, since
+re-running the DB stage (e.g. after a schema change) is the point of it.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from display_live_info import calculate_counters
+from app_config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+cache_config = config.get('cache', {})
+cache_mode = cache_config.get('mode', 'off')
+
+class ResponseCache:
+    def __init__(self, directory, ttl_hours, max_size_mb, compression_level=6):
+        self.directory = directory
+        self.ttl = ttl_hours * 3600 if ttl_hours else None
+        self.max_bytes = max_size_mb * 1024 * 1024 if max_size_mb else None
+        self.compression_level = compression_level
+
+    @staticmethod
+    def key(search_by, search_term, page_number, page_size):
+        request = json.dumps([search_by, str(search_term), int(page_number), int(page_size)])
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json.gz")
+
+    def store(self, search_by, search_term, page_number, page_size, content):
+        path = self.path(self.key(search_by, search_term, page_number, page_size))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"  # write then rename so replay never sees half a page
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=self.compression_level))
+        os.replace(tmp_path, path)
+
+    def _expired(self, mtime, now=None):
+        return self.ttl is not None and (now or time.time()) - mtime > self.ttl
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json.gz'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def iter_pages(self):
+        # sorted by path so replays always feed pages in the same order
+        now = time.time()
+        for path, mtime, _ in sorted(self._entries()):
+            if self._expired(mtime, now):
+                continue
+            with open(path, 'rb') as f:
+                yield gzip.decompress(f.read())
+
+    def prune(self):
+        now = time.time()
+        entries = []
+        removed = 0
+        for path, mtime, size in self._entries():
+            if self._expired(mtime, now):
+                os.remove(path)
+                removed += 1
+            else:
+                entries.append((mtime, size, path))
+        if self.max_bytes is not None:
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in sorted(entries):  # oldest first
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+                removed += 1
+        if removed:
+            logger.info(f"Response cache: evicted {removed} pages.")
+
+response_cache = ResponseCache(
+    cache_config.get('directory', 'response_cache'),
+    cache_config.get('ttl_hours', 48),
+    cache_config.get('max_size_mb', 2048),
+    cache_config.get('compression_level', 6),
+)
+
+def record_page(search_by, search_term, page_number, page_size, content):
+    if cache_mode == "record":
+        response_cache.store(search_by, search_term, page_number, page_size, content)
+
+def replay_cache(raw_data_queue):
+    pages = 0
+    for content in response_cache.iter_pages():
+        raw_data_queue.put((None, content), nbytes=len(content)) # replayed pages aren't journaled
+        calculate_counters("categories")
+        pages += 1
+    logger.info(f"Replayed {pages} cached pages from {response_cache.directory}.")
+    return pages
@@ -0,0 +1,225 @@
+"""
+Embedded storage backends for running without a MySQL server.
+db_handler picks one from [storage] backend and routes save_products_to_db
+(products plus their price_history rows), setup_database, get_row_count and
+iter_product_rows to it:
+  "mysql"    - the MySQL tables (implemented in db_handler itself)
+  "sqlite"   - one local SQLite file in WAL mode, one transaction per batch
+  "columnar" - products kept in memory and written as a columnar snapshot
+               (see columnar_snapshot.py) when the run finishes
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from columnar_snapshot import write_snapshot, iter_snapshot_rows, list_snapshots
+
+logger = logging.getLogger(__name__)
+
+def discount_fraction(original_price, discounted_price):
+    # fraction off the original price, None when the product isn't discounted
+    if discounted_price is None or not original_price or original_price <= 0:
+        return None
+    return (original_price - discounted_price) / original_price
+
+def split_deals(product_infos, min_discount, now):
+    # (rows to upsert into deals, ids to remove from it) for one batch
+    deal_rows = []
+    not_deals = []
+    for product in product_infos:
+        discount = discount_fraction(product.original_price, product.discounted_price)
+        if discount is not None and discount > 0 and discount >= min_discount:
+            deal_rows.append((product.id, product.name, product.original_price, product.discounted_price,
+                              round(discount, 4), product.full_url, now, now))
+        else:
+            not_deals.append(product.id)
+    return deal_rows, not_deals
+
+class StorageBackend:
+    name = None
+
+    def setup(self):
+        pass
+
+    def save_products(self, product_infos, history_rows=()):
+        # returns (rows saved, seconds), (0, 0) on failure; history_rows are the batch's price_history
+        # rows and are written in the same transaction, so a crash can't keep the new prices and lose their history
+        raise NotImplementedError
+
+    def iter_product_rows(self, fetch_size=10000):
+        return iter(())
+
+    def row_count(self):
+        return None
+
+    def close(self):
+        pass
+
+class SQLiteBackend(StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, path, price_history=False, deals=False, min_discount=0.0):
+        self.path = path
+        self.price_history = price_history
+        self.deals = deals
+        self.min_discount = min_discount
+        self.connection = None
+        self.lock = threading.Lock()  # the DB consumer writes, main reads the row count
+
+    def setup(self):
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, not on every commit
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS products (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                original_price REAL,
+                discounted_price REAL,
+                eans TEXT,
+                full_url TEXT,
+                discount_percentage REAL GENERATED ALWAYS AS (
+                    CASE WHEN discounted_price IS NOT NULL AND original_price > 0
+                         THEN (original_price - discounted_price) / original_price END) STORED
+            );
+            CREATE INDEX IF NOT EXISTS idx_discount_percentage ON products (discount_percentage);
+            CREATE INDEX IF NOT EXISTS idx_original_price ON products (original_price);
+            CREATE INDEX IF NOT EXISTS idx_discounted_price ON products (discounted_price);
+        ''')
+        if self.price_history:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS price_history (
+                    product_id TEXT NOT NULL,
+                    observed_at TEXT NOT NULL,
+                    original_price REAL,
+                    discounted_price REAL,
+                    previous_price REAL,
+                    is_drop INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (product_id, observed_at)
+                );
+                CREATE INDEX IF NOT EXISTS idx_drops ON price_history (is_drop, observed_at);
+            ''')
+        if self.deals:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS deals (
+                    product_id TEXT PRIMARY KEY,
+                    name TEXT,
+                    original_price REAL,
+                    discounted_price REAL,
+                    discount_percentage REAL NOT NULL,
+                    full_url TEXT,
+                    first_seen TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_deal_discount ON deals (discount_percentage);
+            ''')
+            self.sync_deals_from_products()
+        self.connection.commit()
+        logger.info(f"Using SQLite storage at {self.path}.")
+
+    def sync_deals_from_products(self):
+        # as db_handler.sync_deals_from_products: unchanged discounted products never reach the writer,
+        # so deals is brought in line with products and the current min_discount at startup
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.connection.execute('''DELETE FROM deals WHERE product_id NOT IN
+                                   (SELECT id FROM products WHERE discount_percentage > 0 AND discount_percentage >= ?)''', (self.min_discount,))
+        self.connection.execute('''INSERT INTO deals
+                                   SELECT id, name, original_price, discounted_price, ROUND(discount_percentage, 4), full_url, ?, ? FROM products
+                                   WHERE discount_percentage > 0 AND discount_percentage >= ?
+                                   ON CONFLICT(product_id) DO UPDATE SET name=excluded.name, original_price=excluded.original_price,
+                                   discounted_price=excluded.discounted_price, discount_percentage=excluded.discount_percentage,
+                                   full_url=excluded.full_url''', (now, now, self.min_discount))
+
+    def save_products(self, product_infos, history_rows=()):
+        start_time = time.time()
+        rows = product_infos  # Product tuples are already in column order
+        try:
+            with self.lock, self.connection:  # one transaction per batch, rolled back on error
+                self.connection.executemany('''INSERT INTO products (id, name, original_price, discounted_price, eans, full_url)
+                                               VALUES (?, ?, ?, ?, ?, ?)
+                                               ON CONFLICT(id) DO UPDATE SET name=excluded.name, original_price=excluded.original_price,
+                                               discounted_price=excluded.discounted_price, eans=excluded.eans, full_url=excluded.full_url''', rows)
+                if self.deals:
+                    deal_rows, not_deals = split_deals(product_infos, self.min_discount, time.strftime('%Y-%m-%d %H:%M:%S'))
+                    self.connection.executemany('''INSERT INTO deals VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                                   ON CONFLICT(product_id) DO UPDATE SET name=excluded.name, original_price=excluded.original_price,
+                                                   discounted_price=excluded.discounted_price, discount_percentage=excluded.discount_percentage,
+                                                   full_url=excluded.full_url, updated_at=excluded.updated_at''', deal_rows)
+                    self.connection.executemany("DELETE FROM deals WHERE product_id = ?", [(product_id,) for product_id in not_deals])
+                if history_rows:
+                    self.connection.executemany("INSERT OR IGNORE INTO price_history VALUES (?, ?, ?, ?, ?, ?)",
+                                                [(product_id, str(observed_at), original_price, discounted_price, previous_price, int(is_drop))
+                                                 for product_id, observed_at, original_price, discounted_price, previous_price, is_drop in history_rows])
+            return len(rows), time.time() - start_time
+        except sqlite3.Error as e:
+            logger.error(f"Error saving products to SQLite: {e}")
+            return 0, 0
+
+    def iter_product_rows(self, fetch_size=10000):
+        # own connection, so reading doesn't hold the writer's lock
+        connection = sqlite3.connect(self.path)
+        try:
+            cursor = connection.execute("SELECT id, name, original_price, discounted_price, eans, full_url FROM products")
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            connection.close()
+
+    def row_count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def close(self):
+        if self.connection is not None:
+            with self.lock:
+                self.connection.close()
+                self.connection = None
+
+class ColumnarSnapshotBackend(StorageBackend):
+    name = "columnar"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.products = {}  # id -> row, later batches replace earlier versions
+        self.lock = threading.Lock()
+
+    def setup(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # start from the latest snapshot: with change detection on only changed rows reach save_products,
+        # and the new snapshot still has to hold the whole catalogue
+        snapshots = list_snapshots(self.directory)
+        if snapshots:
+            with self.lock:
+                for row in iter_snapshot_rows(snapshots[-1]):
+                    self.products[row[0]] = row
+        logger.info(f"Writing a columnar snapshot to {self.directory} at the end of the run ({len(self.products):,} products carried over).")
+
+    def save_products(self, product_infos, history_rows=()):
+        # history_rows are ignored: consecutive snapshots are the history
+        start_time = time.time()
+        with self.lock:
+            for product in product_infos:
+                self.products[product.id] = product
+        return len(product_infos), time.time() - start_time
+
+    def iter_product_rows(self, fetch_size=10000):
+        # what the previous snapshot held (loaded by setup), so the change index starts from there
+        with self.lock:
+            rows = list(self.products.values())
+        return iter(rows)
+
+    def row_count(self):
+        with self.lock:
+            return len(self.products)
+
+    def close(self):
+        with self.lock:
+            if not self.products:
+                return
+            path = os.path.join(self.directory, time.strftime('%Y-%m-%d'))
+            count = write_snapshot(path, self.products.values())
+        logger.info(f"Wrote columnar snapshot of {count:,} products to {path}.")
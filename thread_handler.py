@@ -1,96 +1,241 @@
 import logging
+import multiprocessing
+import os
 import time
 import queue
 from queue import Queue
 import threading
-from query import fetch_sainsburys_products
-from parser import parse_product_data
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from query import fetch_sainsburys_products, peek_last_page, count_products, choose_page_size, smaller_page_size, PageTimeout, MIN_PAGE_SIZE, MAX_PAGE_SHRINKS
+from parser import parse_product_data, parse_raw_page, decode_json
 from db_handler import save_products_to_db, save_category_names
-import toml
+from response_cache import record_page, replay_cache, cache_mode
+from change_index import change_index, change_detection_enabled, price_history_enabled, index_enabled
 from display_live_info import calculate_counters
+from pipeline_queue import MeteredQueue
+from dedupe import seen_products
+from category_stats import category_stats
+from progress_journal import journal
+from columnar_snapshot import SnapshotCollector
+from price_alerts import alerts_enabled, detect_price_drops
+from metrics import parsed_products as parsed_products_metric, parse_seconds, parse_cpu_seconds, record_db_write, db_rows, price_checks_skipped
+from app_config import get_config
 
 logger = logging.getLogger(__name__)
-with open('config.toml', 'r') as f:
-    config = toml.load(f)
-
-parsing_complete = threading.Event()
+config = get_config()
 
 # Global queues and events
-raw_data_queue = Queue()
-parsed_product_queue = Queue()
-category_names_save_queue = Queue()
-category_names_process_queue = Queue()
+# bounded so fetchers block when parsing or the DB falls behind, instead of growing memory without limit
+queue_config = config.get('queues', {})
+raw_data_queue = MeteredQueue("raw pages", maxsize=queue_config.get('raw_max_items', 0), max_bytes=queue_config.get('raw_max_mb', 256) * 1024 * 1024)
+parsed_product_queue = MeteredQueue("parsed pages", maxsize=queue_config.get('parsed_max_pages', 50)) # (page_ref, [Product, ...]) per item
+category_names_save_queue = MeteredQueue("category names")
+# every parsed page also goes to the price drop detector, when price alerts are on
+price_check_queue = MeteredQueue("price checks", maxsize=queue_config.get('parsed_max_pages', 50)) if alerts_enabled else None
+category_names_process_queue = Queue() # filled up front by main, so it can't be bounded
 name_processing_complete = threading.Event()
-name_processing_threads_finished = 0
 name_processing_lock = threading.Lock()
+page_flush_listeners = [] # called by the DB consumer with the page refs each successful flush made durable
 
 # Constants (moved to config.toml)
 BATCH_SIZE = config.get('processing', {}).get('batch_size')
 PAGE_SIZE = config.get('api', {}).get('page_size')
+DEDUPLICATE = config.get('processing', {}).get('deduplicate_products', True)
+PARSER_MODE = config.get('processing', {}).get('parser_mode', 'threads')
+parser_pool = None # ProcessPoolExecutor when parser_mode = "processes"
+storage_config = config.get('storage', {})
+# the columnar backend writes its own snapshot, every other backend gets one alongside
+DAILY_SNAPSHOT = storage_config.get('daily_snapshot', True) and storage_config.get('backend', 'mysql') != "columnar"
+snapshot_collector = SnapshotCollector() if DAILY_SNAPSHOT else None
+# a cache replay re-runs the DB stage on purpose (e.g. after a schema change), so it writes unchanged rows too
+SKIP_UNCHANGED = change_detection_enabled and cache_mode != "replay"
 
-def fetch_data(search_term, page_size, search_by): #added search_by
-    page_number = 1
+# shared by all fetchers for pages 2..N of multi-page categories
+page_executor = ThreadPoolExecutor(max_workers=config.get('api', {}).get('max_page_fanout', 8), thread_name_prefix="Page-Fetcher")
+
+def fetch_page(search_term, page_number, page_size, search_by):
+    # returns the number of products on the page, or None if it couldn't be fetched
+    response = fetch_sainsburys_products(search_term, page_number, page_size, search_by)
+    if response and response.ok:
+        record_page(search_by, search_term, page_number, page_size, response.content)
+        raw_data_queue.put(((search_by, search_term, page_number), response.content), nbytes=len(response.content))
+        return count_products(response.content)
+    return None
+
+def fetch_first_page(search_term, page_size, search_by, shrinks=MAX_PAGE_SHRINKS):
+    # a timed-out page 1 is asked for again at half the size (up to shrinks times) rather than retried as is;
+    # the rest of the category then uses whatever size page 1 came back at. Returns (response, page_size, seconds the request took)
     while True:
-        response = fetch_sainsburys_products(search_term, page_number, page_size, search_by)
-        if response and response.ok:
-            data = response.json()
-            raw_data_queue.put(data)
-            calculate_counters("categories")
-            pagination_info = data.get('controls', {}).get('page', {})
-            current_page = pagination_info.get('active', page_number)
-            last_page = pagination_info.get('last', page_number)
-            if current_page >= last_page:
-                if last_page == 1:
-                    logger.debug(f"Fetched all of category: {search_term}.")
-                else:
-                    logger.debug(f"Fetched all of category: {search_term} -  that had {last_page} pages.")
-                break
-            page_number += 1
-            break
-        break
+        try:
+            response = fetch_sainsburys_products(search_term, 1, page_size, search_by, raise_on_timeout=shrinks > 0 and page_size > MIN_PAGE_SIZE)
+            return response, page_size, response.elapsed.total_seconds() if response is not None else None
+        except PageTimeout:
+            shrinks -= 1
+            page_size = smaller_page_size(page_size)
+            logger.info(f"Category {search_term}: page 1 timed out, retrying with page_size {page_size}.")
+
+def fetch_data(search_term, page_size, search_by): #added search_by
+    start_time = time.time()
+    page_seconds = None
+    known_pages, known_page_size, flushed_pages = journal.resume_state(search_by, search_term)
+    # flushed page numbers only mean something at the size they were fetched with, so a resumed term keeps it
+    page_size = known_page_size or choose_page_size(search_by, search_term, page_size)
+    if known_pages and 1 in flushed_pages:
+        last_page, products = known_pages, 0 # resuming: page 1 is already in the DB and told us the page count
+    else:
+        response, page_size, page_seconds = fetch_first_page(search_term, page_size, search_by, 0 if known_page_size else MAX_PAGE_SHRINKS)
+        if not (response and response.ok):
+            return
+        record_page(search_by, search_term, 1, page_size, response.content)
+        # raw bytes: parsers decode them, and the queue can budget by size
+        raw_data_queue.put(((search_by, search_term, 1), response.content), nbytes=len(response.content))
+        last_page = peek_last_page(response.content)
+        products = count_products(response.content)
+        journal.record_term(search_by, search_term, last_page, page_size)
+    remaining_pages = [page_number for page_number in range(2, last_page + 1) if page_number not in flushed_pages]
+    if remaining_pages:
+        # page 1 tells us how many pages there are, so request the rest all at once
+        counts = list(page_executor.map(lambda page_number: fetch_page(search_term, page_number, page_size, search_by), remaining_pages))
+        missing = counts.count(None)
+        products += sum(count for count in counts if count)
+        if missing:
+            logger.warning(f"Category {search_term}: {missing} of {last_page} pages could not be fetched.")
+    if last_page > 1:
+        logger.debug(f"Fetched all of category: {search_term} -  that had {last_page} pages.")
+    else:
+        logger.debug(f"Fetched all of category: {search_term}.")
+    if not flushed_pages: # a resumed term only fetched part of its pages, so its stats would be off
+        category_stats.record(search_by, search_term, products, last_page, time.time() - start_time, page_size, page_seconds)
+    calculate_counters("categories")
 
 def parse_data():
     thread_name = threading.current_thread().name
     while True:
-        raw_data = raw_data_queue.get()
-        if raw_data is None:
+        item = raw_data_queue.get()
+        if item is None:
             break 
-        products = raw_data.get('products', [])
+        page_ref, raw_data = item
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        products = decode_json(raw_data).get('products', [])
+        if DEDUPLICATE:
+            # skip products another category or search already produced this run
+            keep = seen_products.first_seen([product.get('product_uid') for product in products])
+            products = [product for product, first in zip(products, keep) if first]
         parsed_products, category_names = parse_product_data(products) # Unpack both return values
-        for product in parsed_products:
-            parsed_product_queue.put(product)
+        parse_seconds.observe(time.perf_counter() - started)
+        parse_cpu_seconds.inc(time.thread_time() - cpu_started)
+        parsed_products_metric.inc(len(parsed_products))
+        # the whole page is one item, and its page_ref tells the DB consumer what to journal once it's flushed
+        parsed_product_queue.put((page_ref, parsed_products))
         for category_name in category_names:
             category_names_save_queue.put(category_name)# Add category names to the queue
         raw_data_queue.task_done()
     logger.debug(f"Parser thread {thread_name} finished.")
-    parsing_complete.set()
+
+def parse_data_in_pool(pool):
+    # hands raw pages to a worker process and forwards what comes back; the thread itself
+    # only waits, so the GIL no longer caps parsing throughput
+    thread_name = threading.current_thread().name
+    while True:
+        item = raw_data_queue.get()
+        if item is None:
+            break
+        page_ref, raw_data = item
+        started = time.perf_counter()
+        products, category_names, cpu_seconds = pool.submit(parse_raw_page, raw_data).result()
+        parse_seconds.observe(time.perf_counter() - started)
+        parse_cpu_seconds.inc(cpu_seconds)
+        if DEDUPLICATE:
+            # workers can't share the seen-set, so repeats are dropped here after parsing
+            keep = seen_products.first_seen([product.id if product.id != 'N/A' else None for product in products])
+            products = [product for product, first in zip(products, keep) if first]
+        parsed_products_metric.inc(len(products))
+        parsed_product_queue.put((page_ref, products))
+        for category_name in category_names:
+            category_names_save_queue.put(category_name)
+        raw_data_queue.task_done()
+    logger.debug(f"Parser dispatcher {thread_name} finished.")
+
+def save_batch(batch):
+    # returns False if the batch could not be written
+    if snapshot_collector is not None:
+        snapshot_collector.add(batch)  # before change detection, the snapshot needs unchanged products too
+    if SKIP_UNCHANGED:
+        changed = change_index.changed(batch)
+        if len(changed) < len(batch):
+            calculate_counters("products", len(batch) - len(changed))  # unchanged rows still count as processed
+            db_rows.inc(len(batch) - len(changed), "unchanged")
+    else:
+        changed = batch
+    if not changed:
+        return True
+    # the batch's price_history rows are committed in the same transaction as its products
+    price_changes = change_index.price_changes(changed, datetime.now().replace(microsecond=0)) if price_history_enabled else ()
+    started = time.perf_counter()
+    saved, _ = save_products_to_db(changed, price_changes)
+    record_db_write(len(changed), time.perf_counter() - started, bool(saved))
+    if not saved:
+        return False
+    if index_enabled:
+        change_index.commit(changed)
+    return True
+
+def flush_batch(batch, finished_pages):
+    # every page in finished_pages has all of its rows in this batch or an earlier one
+    if save_batch(batch):
+        journal.mark_flushed(finished_pages, len(batch))
+        for listener in page_flush_listeners:
+            listener(finished_pages)
+    else:
+        logger.warning(f"Batch of {len(batch)} products not saved; {len(finished_pages)} pages will be re-fetched on --resume.")
+    batch.clear()
+    finished_pages.clear()
 
 def start_db_consumer():
     thread_name = threading.current_thread().name
     batch = []
+    finished_pages = []
     while True:
-        try:
-            item = parsed_product_queue.get(timeout=1)  # Use a timeout to avoid indefinite blocking
-            batch.append(item)
-            if len(batch) == BATCH_SIZE:
-                save_products_to_db(batch)
-                parsed_product_queue.task_done()  # Mark tasks as done after processing
-                logger.debug(f"[{thread_name}] Saved {len(batch)} products to db.")
-                batch.clear()
-        except queue.Empty:
-            if parsing_complete.is_set() and name_processing_threads_finished == config.get('processing', {}).get('num_fetcher_threads'):
-                break  # Exit only when parsing is complete and all fetcher threads are done
-            else:
-                continue  # Continue checking for items or completion
+        item = parsed_product_queue.get()
+        parsed_product_queue.task_done()
+        if item is None:
+            break  # end of stream, queued once every parser has finished
+        page_ref, products = item
+        if price_check_queue is not None:
+            # checked as soon as the page arrives, not when its batch is written; never waits on the
+            # detector, so alerts can't slow down saving
+            try:
+                price_check_queue.put_nowait(products)
+            except queue.Full:
+                price_checks_skipped.inc(len(products))
+        batch.extend(products)
+        if page_ref is not None:
+            finished_pages.append(page_ref)
+        if len(batch) >= BATCH_SIZE: # whole pages, so a batch can run over by up to one page
+            logger.debug(f"[{thread_name}] Saving {len(batch)} products to db.")
+            flush_batch(batch, finished_pages)
 
     # Save any remaining items in the batch after the loop finishes
-    if batch:
-        save_products_to_db(batch)
-        parsed_product_queue.task_done()
-        logger.debug(f"[{thread_name}] Saved remaining {len(batch)} products to db.")
-        batch.clear()
+    if batch or finished_pages:
+        logger.debug(f"[{thread_name}] Saving remaining {len(batch)} products to db.")
+        flush_batch(batch, finished_pages)
+    if DEDUPLICATE:
+        logger.info(f"Dropped {seen_products.duplicates:,} duplicate products ({len(seen_products):,} unique).")
 
     category_names_save_queue.put(None)  # Signal category saver to stop after all products are processed
+    if price_check_queue is not None:
+        price_check_queue.put(None)  # blocking is fine here, the last batch is already written
+        if price_checks_skipped.summary():
+            logger.warning(f"Price alerts: {price_checks_skipped.summary():,} products skipped because the detector fell behind.")
+
+def write_daily_snapshot():
+    if snapshot_collector is None:
+        return None
+    path = snapshot_collector.write(storage_config.get('snapshot_dir', 'snapshots'))
+    if path:
+        logger.info(f"Wrote columnar snapshot of {len(snapshot_collector):,} products to {path}.")
+    return path
 
 def fetcher_worker(category_queue, category_names_process_queue):
     thread_name = threading.current_thread().name
@@ -98,7 +243,7 @@ def fetcher_worker(category_queue, category_names_process_queue):
     while True:
         if search_by == "id":
             try:
-                category_id = category_queue.get(timeout=5)
+                category_id = category_queue.get_nowait() # filled before the fetchers start, so empty means done
                 fetch_data(category_id, PAGE_SIZE, search_by)
                 category_queue.task_done()
             except queue.Empty:  # Corrected exception handling
@@ -115,17 +260,22 @@ def fetcher_worker(category_queue, category_names_process_queue):
 
                 while True:
                     try:
-                        category_name = category_names_process_queue.get(timeout=5)
+                        category_name = category_names_process_queue.get_nowait()
                         fetch_data(category_name, PAGE_SIZE, search_by)
                         category_names_process_queue.task_done()
                     except queue.Empty:  # Corrected exception handling HERE as well
-                        with name_processing_lock:  # increment when done a full search
-                            global name_processing_threads_finished  # global declaration
-                            name_processing_threads_finished += 1
                         break
             break  # fetcher has done both category name and id searching
     logger.debug(f"{thread_name}: finished all tasks.")
 
+def close_stage(threads, downstream, sentinels=1):
+    # end of stream for one stage: once all of its threads have returned nothing more can
+    # reach downstream, so the None sentinels go in behind the last real item
+    for thread in threads:
+        thread.join()
+    for _ in range(sentinels):
+        downstream.put(None)
+
 def start_fetcher_threads(category_queue, category_names_process_queue, num_threads): #add new parameter
     threads = []
     for i in range(num_threads):
@@ -135,16 +285,41 @@ def start_fetcher_threads(category_queue, category_names_process_queue, num_thre
     return threads
 
 def start_parser_threads(num_threads):
+    global parser_pool
     threads = []
+    if PARSER_MODE == "processes":
+        num_processes = config.get('processing', {}).get('num_parser_processes') or os.cpu_count()
+        # the workers are started from a clean server process: forking this one, with the fetcher, renderer and
+        # metrics threads already running, could leave a child holding a lock copied mid-use
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        parser_pool = ProcessPoolExecutor(max_workers=num_processes, mp_context=multiprocessing.get_context(start_method))
+        # one dispatcher per worker process keeps every process busy
+        for i in range(num_processes):
+            thread = threading.Thread(target=parse_data_in_pool, args=(parser_pool,), daemon=True, name=f"Parser-Dispatcher-{i+1}")
+            thread.start()
+            threads.append(thread)
+        return threads
     for i in range(num_threads):
         thread = threading.Thread(target=parse_data, daemon=True, name=f"Parser-{i+1}")
         thread.start()
         threads.append(thread)
     return threads
 
+def stop_parser_pool():
+    if parser_pool is not None:
+        parser_pool.shutdown()
 
 def start_category_name_saver_thread():
     thread = threading.Thread(target=save_category_names, args=(category_names_save_queue,), daemon=True, name="Category-Saver")
     thread.start()
     return thread
-    
\ No newline at end of file
+
+def start_price_drop_detector_thread():
+    thread = threading.Thread(target=detect_price_drops, args=(price_check_queue,), daemon=True, name="Price-Alerts")
+    thread.start()
+    return thread
+
+def start_cache_replay_thread():
+    thread = threading.Thread(target=replay_cache, args=(raw_data_queue,), daemon=True, name="Cache-Replay")
+    thread.start()
+    return thread
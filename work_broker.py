@@ -0,0 +1,159 @@
+"""
+Work units for a crawl split across several worker processes/nodes.
+The coordinator (python main.py --coordinator) writes every category id and
+name as a unit into an SQLite broker file on storage all workers can reach.
+Workers (python main.py --worker) lease units with a timeout, renew their
+leases while they run, and mark a unit done only once all of its pages are
+flushed to the database. Units leased by a worker that dies go back to the
+pool when the lease expires.
+"""
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+from app_config import get_config
+
+logger = logging.getLogger(__name__)
+config = get_config()
+
+distributed_config = config.get('distributed', {})
+LEASE_POLL_SECONDS = distributed_config.get('lease_poll_seconds', 5)
+
+class WorkBroker:
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.local = threading.local()  # sqlite connections can't be shared between threads
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # isolation_level=None so BEGIN IMMEDIATE below controls the transactions
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('''CREATE TABLE IF NOT EXISTS work_units (
+                                      id INTEGER PRIMARY KEY, search_by TEXT, term TEXT, state TEXT DEFAULT 'pending',
+                                      owner TEXT, lease_expires REAL, attempts INTEGER DEFAULT 0, UNIQUE (search_by, term))''')
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_units_state ON work_units (search_by, state, lease_expires)")
+            self.local.connection = connection
+        return connection
+
+    def populate(self, search_by, search_terms):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        connection.executemany("INSERT OR IGNORE INTO work_units (search_by, term) VALUES (?, ?)", [(search_by, str(term)) for term in search_terms])
+        connection.execute("COMMIT")
+
+    def reset(self):
+        self.connection().execute("DELETE FROM work_units")
+
+    def lease(self, search_by, owner):
+        # pending units first (in the order the coordinator scheduled them), then ones whose lease ran out
+        connection = self.connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")  # takes the write lock so two workers can't lease the same unit
+        try:
+            row = connection.execute('''SELECT id, term FROM work_units WHERE search_by = ? AND attempts < ?
+                                        AND (state = 'pending' OR (state = 'leased' AND lease_expires < ?))
+                                        ORDER BY state = 'leased', id LIMIT 1''', (search_by, self.max_attempts, now)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE work_units SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                                   (owner, now + self.lease_seconds, row[0]))
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return int(row[1]) if search_by == "id" else row[1]
+
+    def renew(self, owner):
+        self.connection().execute("UPDATE work_units SET lease_expires = ? WHERE owner = ? AND state = 'leased'", (time.time() + self.lease_seconds, owner))
+
+    def complete(self, search_by, search_term, owner):
+        self.connection().execute("UPDATE work_units SET state = 'done' WHERE search_by = ? AND term = ? AND owner = ?", (search_by, str(search_term), owner))
+
+    def release_unfinished(self, owner):
+        # hand back units this worker leased but couldn't finish (e.g. pages that failed to fetch)
+        cursor = self.connection().execute("UPDATE work_units SET state = 'pending', owner = NULL WHERE owner = ? AND state = 'leased'", (owner,))
+        if cursor.rowcount:
+            logger.warning(f"Released {cursor.rowcount} unfinished work units back to the broker.")
+
+    def outstanding(self, search_by):
+        row = self.connection().execute("SELECT COUNT(*) FROM work_units WHERE search_by = ? AND state != 'done' AND attempts < ?",
+                                        (search_by, self.max_attempts)).fetchone()
+        return row[0]
+
+    def held_elsewhere(self, search_by, owner):
+        # (units still to do that this worker doesn't hold, when the soonest of their leases runs out)
+        row = self.connection().execute('''SELECT COUNT(*), MIN(CASE WHEN state = 'leased' THEN lease_expires END) FROM work_units
+                                           WHERE search_by = ? AND state != 'done' AND attempts < ? AND (owner IS NULL OR owner != ?)''',
+                                        (search_by, self.max_attempts, owner)).fetchone()
+        return row[0], row[1]
+
+    def summary(self):
+        return dict(self.connection().execute("SELECT state, COUNT(*) FROM work_units GROUP BY state").fetchall())
+
+class LeasedWorkQueue:
+    # stands in for the local category queues, so fetcher threads and the async fetcher run unchanged
+    def __init__(self, broker, search_by, owner):
+        self.broker = broker
+        self.search_by = search_by
+        self.owner = owner
+
+    def get(self, block=True, timeout=None):
+        # nothing leasable doesn't mean done: units held by other workers come back if those die, so wait for
+        # their leases to run out (or the units to finish) and only report empty once nothing is left elsewhere.
+        # get_nowait waits the same way, it's what the fetcher loops call
+        while True:
+            term = self.broker.lease(self.search_by, self.owner)
+            if term is not None:
+                return term
+            remaining, next_expiry = self.broker.held_elsewhere(self.search_by, self.owner)
+            if not remaining:
+                raise queue.Empty
+            wait = LEASE_POLL_SECONDS if next_expiry is None else next_expiry - time.time()
+            time.sleep(min(max(wait, 0.1), LEASE_POLL_SECONDS))
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        pass  # units are completed from the DB consumer once their pages are flushed
+
+    def empty(self):
+        return self.broker.outstanding(self.search_by) == 0
+
+def worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+worker_suffix = None  # set by use_worker_files() in --worker mode
+
+def use_worker_files(owner):
+    global worker_suffix
+    worker_suffix = owner
+
+def local_path(path):
+    # run-local state files (journal, stats, summaries) get the worker's id in their name,
+    # so several workers sharing a directory don't delete or overwrite each other's
+    if not worker_suffix or not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{worker_suffix}{ext}"
+
+def start_lease_heartbeat(broker, owner, stop_event):
+    def renew_leases():
+        while not stop_event.wait(broker.lease_seconds / 3):
+            broker.renew(owner)
+    thread = threading.Thread(target=renew_leases, daemon=True, name="Lease-Heartbeat")
+    thread.start()
+    return thread
+
+broker = WorkBroker(
+    distributed_config.get('broker_file', 'work_units.sqlite3'),
+    distributed_config.get('lease_seconds', 600),
+    distributed_config.get('max_attempts', 3),
+)